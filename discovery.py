@@ -14,11 +14,28 @@ Zwei Threads laufen parallel:
 - process_outgoing(): verarbeitet eigene WHOIS-Anfragen
 """
 
-import socket, threading, time, traceback
+import socket, struct, threading, time, signal, re
+from collections import OrderedDict
+from functools import lru_cache
 from queue import Empty
-from utils.slcp import parse_message, build_message
+from utils.slcp import parse_message, build_message_bytes
 from utils.config import get_config_value
-from utils.network_utils import detect_broadcast_address
+from utils.network_utils import detect_broadcast_address, get_ipv4_interfaces, make_batch_receiver, send_many
+from utils.logger import get_logger, shutdown_logging
+
+log = get_logger("discovery")
+
+# Vorkompilierte Muster für die Standardformen von WHOIS/IAM (ohne Quoting).
+# Alles andere (z. B. Handles mit Leerzeichen) geht an den vollständigen Parser.
+_WHOIS_RE = re.compile(rb'(WHOIS) ([^\s"\\]+) (\d+)\s*\Z')
+_IAM_RE = re.compile(rb'(IAM) ([^\s"\\]+) ([^\s"\\]+) (\d+)\s*\Z')
+
+OUTGOING_BATCH = 64  # Max. UI-Befehle, die process_outgoing pro Durchlauf abarbeitet
+PEER_SOCK_TTL = 60.0  # Sekunden, die ein verbundener Antwort-Socket wiederverwendet wird
+PEER_SOCK_MAX = 128   # Max. gleichzeitig offene Antwort-Sockets
+IAM_DEDUP_TTL = 30.0   # Gleiche IAM innerhalb dieser Zeit nicht erneut weitergeben
+IAM_PRUNE_AGE = 300.0  # Ältere Einträge werden aus dem IAM-Cache entfernt
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # 4 MiB Sende-/Empfangspuffer gegen Paketverlust bei WHOIS-Stürmen
 
 def run_discovery(queue_from_ui, queue_to_ui_net, config, receive_only=False):
     """
@@ -35,19 +52,91 @@ def run_discovery(queue_from_ui, queue_to_ui_net, config, receive_only=False):
     local_handle = config["handle"]
     autoreply = get_config_value("autoreply")
     local_port = config["port"]
-    joined = False  # Wurde vorher JOIN gesendet?
+    joined = threading.Event()  # Wurde vorher JOIN gesendet? (threadsicher, ohne nonlocal)
 
     # UDP-Socket vorbereiten für Broadcast/Empfang
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-    except AttributeError:
-        pass
+    except (AttributeError, OSError):
+        pass  # Plattform ohne SO_REUSEPORT (z. B. Windows)
     udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    # Größere Puffer (Kernel begrenzt ggf. auf net.core.rmem_max/wmem_max)
+    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
     udp_socket.bind(("", whois_port))
 
-    print(f"[Discovery] Listening on UDP {whois_port}")
+    log.info("[Discovery] Listening on UDP %s", whois_port)
+
+    # Mehrere Datagramme pro Syscall empfangen (recvmmsg unter Linux)
+    recv_batch = make_batch_receiver(udp_socket)
+
+    # Eigene IP vorab ermitteln (get_own_ip() cacht mit TTL)
+    own_ip = get_own_ip()
+
+    # Ziel für WHOIS einmalig bestimmen (keine Interface-Suche pro Paket).
+    # Optional Multicast statt Broadcast: defaults.multicast_group in config.toml,
+    # z. B. "239.255.42.99" – Nicht-Mitglieder filtern dann schon in der Netzwerkkarte.
+    mcast_group = get_config_value("multicast_group")
+    if mcast_group:
+        mreq = struct.pack("4s4s", socket.inet_aton(mcast_group), socket.inet_aton("0.0.0.0"))
+        udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        bcast_addr = (mcast_group, whois_port)
+    else:
+        bcast_addr = (detect_broadcast_address(), whois_port)
+
+    # IAM vorab kodieren (Handle und Port sind fest, die IP ändert sich selten)
+    iam_bytes = build_message_bytes("IAM", local_handle, own_ip, local_port)
+
+    def current_iam():
+        """
+        @brief Liefert die kodierte IAM-Nachricht; baut sie nur neu, wenn sich die IP geändert hat.
+        """
+        nonlocal own_ip, iam_bytes
+        ip = get_own_ip()
+        if ip != own_ip:
+            own_ip = ip
+            iam_bytes = build_message_bytes("IAM", local_handle, own_ip, local_port)
+        return iam_bytes
+
+    @lru_cache(maxsize=64)
+    def whois_bytes(handle):
+        """
+        @brief Liefert die kodierte WHOIS-Nachricht für einen Handle (gecacht).
+        """
+        return build_message_bytes("WHOIS", handle, str(local_port))
+
+    # Verbundene UDP-Sockets pro Anfragendem: Route wird einmal beim connect() aufgelöst
+    peer_socks = OrderedDict()  # (ip, port) -> (socket, Erstellzeit)
+
+    def send_to_peer(data, dest):
+        """
+        @brief Sendet eine Antwort über einen gecachten, verbundenen UDP-Socket.
+        @details Sockets werden nach PEER_SOCK_TTL neu aufgebaut; über PEER_SOCK_MAX
+                 hinaus wird der am längsten ungenutzte geschlossen. Nur von receive_whois genutzt.
+        @param data Kodierte SLCP-Nachricht
+        @param dest Ziel als (ip, port)
+        """
+        now = time.monotonic()
+        entry = peer_socks.get(dest)
+        if entry is None or now - entry[1] > PEER_SOCK_TTL:
+            if entry is not None:
+                entry[0].close()
+                del peer_socks[dest]
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect(dest)
+            except OSError:
+                s.close()
+                raise
+            entry = (s, now)
+            peer_socks[dest] = entry
+            if len(peer_socks) > PEER_SOCK_MAX:
+                peer_socks.popitem(last=False)[1][0].close()
+        peer_socks.move_to_end(dest)
+        entry[0].send(data)
 
     def receive_whois():
         """
@@ -57,52 +146,84 @@ def run_discovery(queue_from_ui, queue_to_ui_net, config, receive_only=False):
         - Erkennt WHOIS, prüft auf eigenen Handle, sendet ggf. IAM oder Auto-Reply
         - Erkennt IAM und gibt Info an UI weiter
         """
-        nonlocal joined
+        errors = 0  # Aufeinanderfolgende Empfangsfehler (für Backoff)
+        seen_iam = {}  # (handle, ip, port) -> Zeitpunkt der letzten Weitergabe
+        last_prune = time.monotonic()
+
+        # Im Hotpath genutzte Funktionen einmalig als lokale Namen binden (LOAD_FAST statt Global-Lookup)
+        whois_match, iam_match, parse, monotonic = _WHOIS_RE.match, _IAM_RE.match, parse_message, time.monotonic
         while True:
             try:
-                # Nachricht empfangen
-                data, addr = udp_socket.recvfrom(1024)
-                msg = data.decode().strip()
-                parsed = parse_message(msg)
-
-                # WHOIS → prüfen ob an mich
-                if parsed["command"] == "WHOIS" and parsed["params"][0] == local_handle:
-                    if not joined:
-                        print("[Discovery] WHOIS empfangen, aber nicht joined.")
-                        # Bei Inaktivität optional Auto-Reply senden
+                # Datagramme empfangen (blockiert, liefert ggf. mehrere pro Syscall)
+                batch = recv_batch()
+                errors = 0
+            except OSError as e:
+                log.warning("[Discovery-Fehler] %s", e)
+                # Nur bei wiederholten Fehlern kurz pausieren
+                errors += 1
+                if errors >= 5:
+                    time.sleep(0.1)
+                continue
+
+            for data, addr in batch:
+                # Schnellfilter nur auf das Befehlswort: WHOIS und IAM werden geparst
+                # (JOIN, LEAVE usw. ignoriert dieser Thread ohnehin). Ob ein WHOIS uns
+                # meint, wird erst nach dem Parsen verglichen – der Handle kann gequotet sein.
+                cmd = data.lstrip()
+                if not (cmd.startswith(b"WHOIS") or cmd.startswith(b"IAM")):
+                    continue
+                try:
+                    # Schneller Regex-Pfad für die Standardformen, sonst voller Parser
+                    m = whois_match(data) or iam_match(data)
+                    if m:
+                        parsed = {"command": m.group(1).decode(), "params": [g.decode() for g in m.groups()[1:]]}
+                    else:
+                        parsed = parse(data)
+
+                    # WHOIS → prüfen ob an mich
+                    if parsed["command"] == "WHOIS" and parsed["params"][0] == local_handle:
+                        if not joined.is_set():
+                            log.info("[Discovery] WHOIS empfangen, aber nicht joined.")
+                            # Bei Inaktivität optional Auto-Reply senden
+                            try:
+                                port = int(parsed["params"][1])
+                                if autoreply:
+                                    rmsg = build_message_bytes("MSG", local_handle, "[autoreply] " + autoreply)
+                                    send_to_peer(rmsg, (addr[0], port))
+                                    log.info("[Discovery] Auto-Reply an %s:%s", addr[0], port)
+                            except:
+                                pass
+                            continue  # Keine IAM senden
+
+                        # IAM per Unicast nur an den Anfragenden senden
                         try:
                             port = int(parsed["params"][1])
-                            if autoreply:
-                                rmsg = build_message("MSG", local_handle, "[autoreply] " + autoreply)
-                                udp_socket.sendto(rmsg.encode(), (addr[0], port))
-                                print(f"[Discovery] Auto-Reply an {addr[0]}:{port}")
+                            send_to_peer(current_iam(), (addr[0], port))
+                            log.info("[Discovery] IAM an %s:%s", addr[0], port)
                         except:
-                            pass
-                        continue  # Keine IAM senden
-
-                    # IAM senden
-                    try:
-                        port = int(parsed["params"][1])
-                        iam_msg = build_message("IAM", local_handle, get_own_ip(), local_port)
-                        bcast = detect_broadcast_address()
-                        udp_socket.sendto(iam_msg.encode(), (bcast, whois_port))
-                        print(f"[Discovery] IAM an {bcast}:{whois_port}")
-                    except:
-                        continue
-
-                # IAM empfangen → an UI senden
-                elif parsed["command"] == "IAM":
-                    h, ip, port = parsed["params"]
-                    queue_to_ui_net.put({
-                        "type": "iam",
-                        "handle": h,
-                        "ip": ip,
-                        "port": int(port)
-                    })
-
-            except Exception as e:
-                print(f"[Discovery-Fehler] {e}")
-            time.sleep(0.1)
+                            continue
+
+                    # IAM empfangen → an UI senden (Wiederholungen innerhalb IAM_DEDUP_TTL verwerfen)
+                    elif parsed["command"] == "IAM":
+                        h, ip, port = parsed["params"]
+                        key = (h, ip, int(port))
+                        now = monotonic()
+                        if now - seen_iam.get(key, -IAM_DEDUP_TTL) < IAM_DEDUP_TTL:
+                            continue
+                        seen_iam[key] = now
+                        if now - last_prune > IAM_PRUNE_AGE:
+                            for k in [k for k, ts in seen_iam.items() if now - ts > IAM_PRUNE_AGE]:
+                                del seen_iam[k]
+                            last_prune = now
+                        queue_to_ui_net.put({
+                            "type": "iam",
+                            "handle": h,
+                            "ip": ip,
+                            "port": int(port)
+                        })
+
+                except Exception as e:
+                    log.warning("[Discovery-Fehler] %s", e)
 
     def process_outgoing():
         """
@@ -110,60 +231,119 @@ def run_discovery(queue_from_ui, queue_to_ui_net, config, receive_only=False):
 
         @details
         Erkennt JOIN, LEAVE, WHOIS → verarbeitet Zustand und verschickt WHOIS.
+        Nach dem ersten Eintrag wird der Rückstau der Queue (max. OUTGOING_BATCH)
+        in einem Rutsch abgearbeitet; doppelte WHOIS im selben Batch gehen nur einmal raus,
+        alle WHOIS eines Batches zusammen per send_many() (ein sendmmsg-Aufruf unter Linux).
         """
-        nonlocal joined
         if receive_only:
             return
         while True:
-            try:
-                # CLI-Eingabe abholen
-                item = queue_from_ui.get(timeout=0.1)
-                raw = item["data"].strip()
-                parsed = parse_message(raw)
-                cmd = parsed["command"]
-
-                # JOIN/LEAVE aktualisiert Zustand
-                if cmd == "JOIN":
-                    joined = True
-                    print("[Discovery] JOIN → aktiv")
-                elif cmd == "LEAVE":
-                    joined = False
-                    print("[Discovery] LEAVE → inaktiv")
-                elif cmd == "WHOIS":
-                    if not joined:
-                        print("[Discovery] WHOIS blockiert – nicht joined.")
-                        continue
-                    # WHOIS senden
-                    handle = parsed["params"][0]
-                    msg = build_message("WHOIS", handle, str(local_port))
-                    bcast = detect_broadcast_address()
-                    udp_socket.sendto(msg.encode(), (bcast, whois_port))
-                    print(f"[Discovery] WHOIS gesendet: {msg}")
-
-            except Empty:
-                pass  # keine Nachricht da
-            except Exception:
-                print("[Discovery-WHOIS-Fehler]")
-                traceback.print_exc()
+            # CLI-Eingabe abholen (blockiert ohne Polling), dann Rückstau leeren
+            items = [queue_from_ui.get()]
+            while len(items) < OUTGOING_BATCH:
+                try:
+                    items.append(queue_from_ui.get_nowait())
+                except Empty:
+                    break
+
+            sent = set()  # In diesem Batch bereits gesuchte Handles
+            outgoing = []  # WHOIS-Pakete dieses Batches, gemeinsam per send_many verschickt
+            for item in items:
+                try:
+                    raw = item["data"].strip()
+                    parsed = parse_message(raw)
+                    cmd = parsed["command"]
+
+                    # JOIN/LEAVE aktualisiert Zustand
+                    if cmd == "JOIN":
+                        joined.set()
+                        log.info("[Discovery] JOIN → aktiv")
+                    elif cmd == "LEAVE":
+                        joined.clear()
+                        log.info("[Discovery] LEAVE → inaktiv")
+                    elif cmd == "WHOIS":
+                        if not joined.is_set():
+                            log.info("[Discovery] WHOIS blockiert – nicht joined.")
+                            continue
+                        # WHOIS senden (Duplikate im Batch überspringen)
+                        handle = parsed["params"][0]
+                        if handle in sent:
+                            continue
+                        sent.add(handle)
+                        outgoing.append(whois_bytes(handle))
+
+                except Exception:
+                    log.exception("[Discovery-WHOIS-Fehler]")
+
+            if outgoing:
+                try:
+                    send_many(udp_socket, outgoing, bcast_addr)
+                    log.info("[Discovery] WHOIS gesendet: %s", ", ".join(sent))
+                except Exception:
+                    log.exception("[Discovery-WHOIS-Fehler]")
 
     # Threads starten
     threading.Thread(target=receive_whois, daemon=True).start()
     threading.Thread(target=process_outgoing, daemon=True).start()
 
-    # Hauptprozess bleibt aktiv
-    while True:
-        time.sleep(1)
+    # Hauptthread schläft bis SIGTERM/SIGINT (kein periodisches Aufwachen)
+    stop = threading.Event()
+    try:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+    except ValueError:
+        pass  # nicht im Hauptthread gestartet → Prozessende beendet uns
+    stop.wait()
+    udp_socket.close()
+    shutdown_logging()
+
+OWN_IP_TTL = 60.0  # Sekunden, nach denen die eigene IP neu ermittelt wird
+_ip_cache = {"ip": None, "ts": 0.0}
 
 def get_own_ip() -> str:
+    """
+    @brief Liefert die lokale IP-Adresse aus dem Cache.
+
+    @details
+    Die eigentliche Ermittlung (_detect_own_ip) läuft höchstens alle OWN_IP_TTL
+    Sekunden, damit ein Wechsel des Netzwerks trotzdem bemerkt wird.
+
+    @return Lokale IP-Adresse
+    """
+    now = time.monotonic()
+    if _ip_cache["ip"] is None or now - _ip_cache["ts"] > OWN_IP_TTL:
+        _ip_cache["ip"] = _detect_own_ip()
+        _ip_cache["ts"] = now
+    return _ip_cache["ip"]
+
+def _detect_own_ip() -> str:
     """
     @brief Ermittelt lokale IP-Adresse des Systems.
 
     @details
-    Baut Dummy-Verbindung zu 8.8.8.8 auf, um lokale IP herauszufinden.
-    Es findet kein echter Datentransfer statt.
+    Liest zuerst die IPv4-Adressen der Netzwerkschnittstellen (getifaddrs bzw. netifaces) und
+    nimmt die erste Adresse mit Broadcast – also dieselbe Schnittstelle, die auch
+    detect_broadcast_address() wählt. Kein Socket, kein DNS, keine Default-Route nötig.
+    Nur falls das scheitert, wird wie bisher eine Dummy-Verbindung zu 8.8.8.8
+    aufgebaut (ohne echten Datentransfer).
 
     @return Lokale IP-Adresse (z. B. „192.168.0.15“), Fallback: „127.0.0.1“
     """
+    table = get_ipv4_interfaces()
+    if table is not None:
+        for entry in table.values():
+            if entry["broadcast"] and not entry["loopback"]:
+                return entry["addr"]
+
+    try:
+        import netifaces
+        for iface in netifaces.interfaces():
+            for entry in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+                if "broadcast" in entry and entry.get("addr"):
+                    return entry["addr"]
+    except Exception:
+        pass
+
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
@@ -3,100 +3,106 @@
 @brief Gemeinsame Queues für die Interprozesskommunikation (IPC) zwischen CLI, GUI, Netzwerk und Discovery.
 
 @details
-Dieses Modul stellt alle zentralen Queues für den Datenaustausch im BSRN-Chatprogramm bereit.
+Dieses Modul erzeugt alle zentralen Queues für den Datenaustausch im BSRN-Chatprogramm.
 Sie dienen der Kommunikation zwischen den drei Hauptprozessen:
 
 - Benutzeroberfläche (UI: CLI oder GUI)
 - Netzwerkprozess (JOIN, MSG, IMG, LEAVE, IAM etc.)
 - Discoveryprozess (WHOIS, IAM)
 
-Durch diese Queues können SLCP-Kommandos, Textnachrichten, Bilder, Teilnehmerlisten und WHOIS-Antworten
+Durch diese Queues können SLCP-Kommandos, Textnachrichten, Bildpfade, Teilnehmerlisten und WHOIS-Antworten
 sicher zwischen Prozessen übergeben werden.
+
+Die Queues entstehen erst durch create_queues() in main() – nicht beim Import. Unter
+forkserver/spawn importiert jeder Kindprozess dieses Modul erneut; Queues auf Modulebene
+würden dort jedes Mal zusätzlich (und ungenutzt) angelegt.
 """
 
+from collections import namedtuple
 from multiprocessing import Queue
-
-
-# ==============================================================
-# UI → Netzwerk: Von CLI/GUI zur Verarbeitung im Netzwerkprozess
-# ==============================================================
-
-queue_ui_to_net = Queue()
+from queue import Empty
+
+# Optional: faster_fifo (C-Implementierung von multiprocessing.Queue)
+try:
+    from faster_fifo import Queue as _FasterFifoQueue
+except ImportError:
+    FastQueue = None
+else:
+    class FastQueue(_FasterFifoQueue):
+        """
+        @brief faster_fifo-Queue, deren get() ohne Timeout wirklich unbegrenzt blockiert.
+        @details
+        faster_fifo.Queue.get() hat einen endlichen Standard-Timeout (10 s) und wirft danach Empty.
+        Die Verbraucher (handle_ui, listener_net) erwarten aber das Verhalten von
+        multiprocessing.Queue: get() wartet, bis etwas da ist.
+        """
+        def get(self, block=True, timeout=None):
+            if not block or timeout is not None:
+                return super().get(block, timeout)
+            while True:
+                try:
+                    return super().get(True)
+                except Empty:
+                    continue
+
+# Puffergröße für Text- und Steuernachrichten. Bilder laufen nicht durch die Queue:
+# die UI schickt nur den Dateipfad, das Netzwerk sendet per sendfile() direkt aus der Datei.
+FAST_QUEUE_BYTES = 1024 * 1024
+
+
+def _hot_path_queue():
+    """
+    @brief Erzeugt eine Queue für den Nachrichten-Hotpath zwischen UI und Netzwerk.
+
+    @details
+    Ist `faster_fifo` installiert, wird dessen Queue verwendet (API-kompatibel:
+    put, get, get_nowait, empty). Andernfalls wird auf multiprocessing.Queue zurückgefallen.
+    Die selten genutzten WHOIS/IAM-Queues bleiben immer multiprocessing.Queue.
+    """
+    if FastQueue is not None:
+        return FastQueue(max_size_bytes=FAST_QUEUE_BYTES)
+    return Queue()
+
+
+IpcQueues = namedtuple("IpcQueues", "ui_to_net net_to_ui ui_to_discovery discovery_to_ui discovery_to_net")
 """
-@brief Sende-Queue vom UI-Prozess an den Netzwerkprozess.
+@brief Alle Queues des Chatprogramms, erzeugt von create_queues().
 
 @details
-Diese Queue überträgt SLCP-Befehle wie JOIN, MSG, IMG oder LEAVE.
-Der Netzwerkprozess verarbeitet die übergebenen SLCP-Daten und führt passende Netzwerkaktionen aus.
-
-Mögliche Datenformate:
+ui_to_net – Sende-Queue vom UI-Prozess an den Netzwerkprozess (SLCP-Befehle wie JOIN, MSG, IMG, LEAVE):
 - {"type": "broadcast", "data": "<SLCP-Nachricht>"}
 - {"type": "direct_text", "to": "<Empfänger-Handle>", "data": "<SLCP-Nachricht>"}
 - {"type": "direct_image", "to": "<Handle>", "data": "<SLCP-Nachricht>", "binary": <Binärdaten>}
-"""
-
-
-# =====================================================================
-# Netzwerk → UI: Netzwerkprozess liefert empfangene Daten an das UI zurück
-# =====================================================================
+  (nur für kleine Daten – muss in FAST_QUEUE_BYTES passen)
+- {"type": "direct_image_file", "to": "<Handle>", "path": "<Bildpfad>"}  (Größe bestimmt der Netzwerkprozess)
 
-queue_net_to_ui = Queue()
-"""
-@brief Empfangs-Queue vom Netzwerkprozess an die Benutzeroberfläche.
-
-@details
-Diese Queue wird verwendet, um empfangene Textnachrichten, Bilder oder Peer-Listen
-an das UI (CLI oder GUI) zu senden. Damit können eingehende Nachrichten dargestellt werden.
-
-Beispielhafte Formate:
+net_to_ui – Empfangs-Queue vom Netzwerkprozess an die Benutzeroberfläche:
 - {"type": "text", "from": "<Sender-Handle>", "text": "<Nachricht>"}
 - {"type": "image", "from": "<Sender-Handle>", "path": "<Bildpfad>"}
 - {"type": "peers_update", "peers": ["<handle1>", "<handle2>", ...]}
-"""
-
-
-# =============================================
-# UI → Discovery: WHOIS-Anfrage auslösen
-# =============================================
-
-queue_ui_to_discovery = Queue()
-"""
-@brief Sende-Queue vom UI an den Discoveryprozess.
-
-@details
-Diese Queue transportiert WHOIS-Anfragen, z. B. wenn der Nutzer „whois Alice“ eingibt.
+- {"type": "batch", "items": [<mehrere der obigen Einträge>]}  (mehrere UDP-Nachrichten aus einem Empfangsstapel)
 
-Format:
+ui_to_discovery – WHOIS-Anfragen vom UI an den Discoveryprozess, z. B. bei „whois Alice“:
 - {"data": "<SLCP-Nachricht für WHOIS>"}
-"""
-
-
-# ===================================================
-# Discovery → UI: IAM-Antworten an Benutzeroberfläche
-# ===================================================
-
-queue_discovery_to_ui = Queue()
-"""
-@brief Empfangs-Queue für IAM-Antworten vom Discoveryprozess an die UI.
 
-@details
-Die IAM-Antwort enthält IP-Adresse und Port des gesuchten Peers,
-z. B. als Reaktion auf eine WHOIS-Anfrage.
-
-Format:
+discovery_to_ui – IAM-Antworten vom Discoveryprozess an die UI:
 - {"type": "iam", "handle": "<Benutzername>", "ip": "<IP-Adresse>", "port": <Portnummer>}
-"""
-
 
-# ================================================
-# Discovery → Netzwerk: Peers an Netzwerkprozess
-# ================================================
-
-queue_discovery_to_net = Queue()
+discovery_to_net – Ergebnisse der WHOIS-Suche (neue Peer-Adressen) an den Netzwerkprozess.
 """
-@brief Interne Queue vom Discoveryprozess zum Netzwerkprozess.
 
-@details
-Diese Queue überträgt Ergebnisse der WHOIS-Suche (z. B. neue Peer-Adressen) direkt
-an den Netzwerkprozess, um Peer-Verbindungen aufzubauen.
-"""
+
+def create_queues() -> IpcQueues:
+    """
+    @brief Erzeugt alle IPC-Queues.
+    @details Nur einmal im Hauptprozess aufrufen; die Kindprozesse bekommen die Queues
+             als Argumente übergeben.
+    @return IpcQueues mit den beiden Hotpath-Queues (UI ↔ Netzwerk) und den Discovery-Queues
+    """
+    return IpcQueues(
+        ui_to_net=_hot_path_queue(),
+        net_to_ui=_hot_path_queue(),
+        ui_to_discovery=Queue(),
+        discovery_to_ui=Queue(),
+        discovery_to_net=Queue(),
+    )
@@ -6,21 +6,27 @@ Dieses Modul startet das gesamte Chatprogramm im Netzwerkmodus (CLI).
 Die Prozesse für Netzwerk und Discovery laufen separat.
 """
 
+import argparse
 import multiprocessing
+from multiprocessing.connection import wait
 import sys
 import os
+import ctypes
 
-# Import der globalen IPC-Queues
-from ipc import (
-    queue_ui_to_net,
-    queue_net_to_ui,
-    queue_ui_to_discovery,
-    queue_discovery_to_ui,
-    queue_discovery_to_net
-)
+try:
+    import fcntl
+except ImportError:      # Windows: kein flock
+    fcntl = None
+
+# IPC-Queues werden erst in main() erzeugt (nicht beim Import)
+from ipc import create_queues
 
 DISCOVERY_LOCK = "/tmp/bsrn_discovery.lock"  
 
+# Optional: UI und Kindprozesse auf getrennte CPU-Kerne pinnen (BSRN_PIN_CPUS=1)
+PIN_CPUS = os.environ.get("BSRN_PIN_CPUS") == "1"
+PROCESS_SET_INFORMATION = 0x0200     # Windows: Zugriffsrecht für SetProcessAffinityMask
+
 # Konfiguration laden/speichern
 from utils.config import get_or_create_client_config
 
@@ -28,59 +34,162 @@ from utils.config import get_or_create_client_config
 import ui_cli
 import network
 import discovery
-import socket 
 
 
 
 config = None
+queues = None
 p_disc = None
+_lock_fd = None
+_pinned = 0
+_cpus = None     # Erlaubte Kerne, einmal vor dem ersten Pinning ermittelt
 
-def is_discovery_running_by_lock():
-    if not os.path.exists(DISCOVERY_LOCK):
-        return False
+def _kernel32():
+    """
+    @brief Lädt kernel32 mit den für das Pinning nötigen Signaturen (nur Windows).
+    """
+    k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    k32.GetCurrentProcess.restype = ctypes.c_void_p
+    k32.OpenProcess.restype = ctypes.c_void_p
+    k32.OpenProcess.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_uint32]
+    k32.GetProcessAffinityMask.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t),
+                                           ctypes.POINTER(ctypes.c_size_t)]
+    k32.SetProcessAffinityMask.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    k32.CloseHandle.argtypes = [ctypes.c_void_p]
+    return k32
+
+def _allowed_cpus():
+    """
+    @brief Ermittelt die Kerne, auf denen dieser Prozess laufen darf.
+    @return Sortierte Liste der Kern-Nummern; leer, wenn die Plattform das nicht unterstützt (z. B. macOS)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    if sys.platform == "win32":
+        k32 = _kernel32()
+        mask, system = ctypes.c_size_t(), ctypes.c_size_t()
+        if k32.GetProcessAffinityMask(k32.GetCurrentProcess(), ctypes.byref(mask), ctypes.byref(system)):
+            return [i for i in range(mask.value.bit_length()) if mask.value >> i & 1]
+    return []
 
+def _set_affinity(pid, cpu):
+    """
+    @brief Bindet einen Prozess an genau einen Kern.
+    @details Linux über os.sched_setaffinity, Windows über SetProcessAffinityMask (ctypes).
+    @param pid Prozess-ID; 0 für den aufrufenden Prozess
+    @param cpu Kern-Nummer
+    @throws OSError wenn das Betriebssystem das Pinning ablehnt
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, {cpu})
+        return
+    k32 = _kernel32()
+    handle = k32.GetCurrentProcess() if pid == 0 else k32.OpenProcess(PROCESS_SET_INFORMATION, False, pid)
+    if not handle:
+        raise ctypes.WinError(ctypes.get_last_error())
     try:
-        with open(DISCOVERY_LOCK, "r") as f:
-            pid = int(f.read().strip())
-        # Prüfen, ob Prozess mit dieser PID noch lebt
-        os.kill(pid, 0)
-        return True  # Prozess existiert → Lock ist gültig
-    except (ValueError, ProcessLookupError, PermissionError):
-        # Prozess existiert nicht → Lock ist veraltet
-        unmark_discovery()
-        return False
+        if not k32.SetProcessAffinityMask(handle, 1 << cpu):
+            raise ctypes.WinError(ctypes.get_last_error())
+    finally:
+        if pid != 0:
+            k32.CloseHandle(handle)
 
-def mark_discovery_running():
-    with open(DISCOVERY_LOCK, "w") as f:
-        f.write(str(os.getpid())) 
+def _pin_cpus():
+    """
+    @return Erlaubte Kerne, wenn Pinning aktiv und sinnvoll ist (mind. 2 Kerne), sonst None
+    """
+    global _cpus
+    if not PIN_CPUS:
+        return None
+    if _cpus is None:
+        _cpus = _allowed_cpus()
+    return _cpus if len(_cpus) >= 2 else None
 
-def unmark_discovery():
-    if os.path.exists(DISCOVERY_LOCK):
-        os.remove(DISCOVERY_LOCK)
+def pin_ui():
+    """
+    @brief Pinnt den UI-Prozess (diesen Hauptprozess) auf den ersten erlaubten Kern.
+    @details Gegenstück zu pin_process(): die Kinder meiden genau diesen Kern.
+             Erst nach dem Start des ersten Kindprozesses aufrufen, damit der forkserver
+             nicht mit auf Kern 0 festgelegt wird.
+    """
+    if not (cpus := _pin_cpus()):
+        return
+    try:
+        _set_affinity(0, cpus[0])
+    except OSError as e:
+        print(f"[WARNUNG] CPU-Pinning für den UI-Prozess fehlgeschlagen: {e}")
+
+def pin_process(p):
+    """
+    @brief Pinnt einen gestarteten Kindprozess auf einen eigenen CPU-Kern.
+    @details
+    Nur aktiv mit BSRN_PIN_CPUS=1, unter Linux (os.sched_setaffinity) und Windows
+    (SetProcessAffinityMask). Kern 0 der erlaubten Menge bleibt dem UI-Prozess (siehe pin_ui()),
+    die Kinder bekommen der Reihe nach die folgenden (reihum über die übrigen Kerne, nie Kern 0).
+    @param p Gestarteter multiprocessing.Process
+    """
+    global _pinned
+    if not (cpus := _pin_cpus()):
+        return
+    _pinned += 1
+    try:
+        _set_affinity(p.pid, cpus[1 + (_pinned - 1) % (len(cpus) - 1)])
+    except OSError as e:
+        print(f"[WARNUNG] CPU-Pinning für {p.name} fehlgeschlagen: {e}")
+
+def acquire_discovery_lock():
+    """
+    @brief Versucht, den systemweiten Discovery-Lock zu bekommen.
+    @details
+    Atomar über fcntl.flock(LOCK_EX | LOCK_NB) auf einem offen gehaltenen Dateideskriptor.
+    Das Betriebssystem gibt den Lock beim Prozessende selbst frei – veraltete PIDs
+    müssen nicht mehr aufgeräumt werden.
+    @return True, wenn dieser Prozess jetzt den Lock hält; False, wenn bereits ein Discovery-Dienst läuft
+    """
+    global _lock_fd
+    if _lock_fd is not None:
+        return True
+    if fcntl is None:
+        return True
+
+    fd = open(DISCOVERY_LOCK, "w")
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fd.close()
+        return False
+    _lock_fd = fd
+    return True
+
+def spawn_service(target, args, name):
+    """
+    @brief Erzeugt und startet einen Dienstprozess.
+    @param target Einstiegsfunktion des Prozesses
+    @param args Argumente für target
+    @param name Prozessname
+    @return Gestarteter multiprocessing.Process
+    """
+    p = multiprocessing.Process(target=target, args=args, name=name)
+    p.start()
+    pin_process(p)
+    return p
 
 def start_discovery_process():
     global p_disc
 
-    if is_discovery_running_by_lock():
-        print("[INFO] Discovery-Prozess läuft bereits. Lokaler Empfänger wird gestartet.")
-        p_disc = multiprocessing.Process(
-            target=discovery.run_discovery,
-            args=(queue_ui_to_discovery, queue_discovery_to_net, config),
-            name="Discovery-Receiver"
-        )
-        p_disc.start()
+    # Pro Client höchstens ein Discovery-Prozess
+    if p_disc is not None and p_disc.is_alive():
         return
 
-    # Voller Prozess, nur wenn noch keiner läuft
-    if p_disc is None or not p_disc.is_alive():
-        p_disc = multiprocessing.Process(
-            target=discovery.run_discovery,
-            args=(queue_ui_to_discovery, queue_discovery_to_net, config),
-            name="Discovery-Prozess"
-        )
-        p_disc.start()
-        mark_discovery_running()
-        print(f"[INFO] Discovery-Prozess gestartet (PID: {p_disc.pid})")
+    if not acquire_discovery_lock():
+        print("[INFO] Discovery-Prozess läuft bereits. Lokaler Empfänger wird gestartet.")
+        name = "Discovery-Receiver"
+    else:
+        name = "Discovery-Prozess"
+
+    p_disc = spawn_service(discovery.run_discovery,
+                           (queues.ui_to_discovery, queues.discovery_to_net, config), name)
+    print(f"[INFO] {name} gestartet (PID: {p_disc.pid})")
 
 def main():
     """
@@ -88,13 +197,20 @@ def main():
     @details Startet Netzwerk- und Discoveryprozess und führt CLI im Hauptprozess aus.
     """
 
-    global config
+    global config, queues
+
+    parser = argparse.ArgumentParser(description="BSRN-Chatprogramm (CLI-Modus)")
+    parser.add_argument("--handle", help="Benutzername; ohne Angabe wird interaktiv gefragt")
+    args = parser.parse_args()
 
     print("== BSRN-Chatprogramm Initialisierung (CLI-Modus) ==")
 
-    # Benutzername abfragen
-    print("Bitte gib deinen Namen (Handle) ein:")
-    handle = input("> ").strip()
+    # Benutzername aus den Argumenten oder interaktiv abfragen
+    if args.handle is not None:
+        handle = args.handle.strip()
+    else:
+        print("Bitte gib deinen Namen (Handle) ein:")
+        handle = input("> ").strip()
     if not handle:
         print("[Fehler] Handle darf nicht leer sein.")
         sys.exit(1)
@@ -106,35 +222,62 @@ def main():
         print(f"[Fehler] Konfigurationsfehler: {e}")
         sys.exit(1)
 
-    # Netzwerkprozess starten
-    p_net = multiprocessing.Process(
-        target=network.run_network,
-        args=(queue_ui_to_net, queue_net_to_ui, queue_discovery_to_net, config),
-        name="Netzwerk-Prozess"
-    )
+    # Queues einmal im Hauptprozess anlegen; die Kindprozesse bekommen sie als Argumente
+    queues = create_queues()
 
-    p_net.start()
+    # Netzwerkprozess starten
+    p_net = spawn_service(network.run_network,
+                          (queues.ui_to_net, queues.net_to_ui, queues.discovery_to_net, config),
+                          "Netzwerk-Prozess")
 
     print(f"[INFO] Prozess gestartet: {p_net.name} (PID: {p_net.pid})")
-    if p_disc is not None:
-       print(f"[INFO] Prozess gestartet: {p_disc.name} (PID: {p_disc.pid})")
 
-    ui_cli.run_cli(queue_ui_to_net, queue_net_to_ui, queue_ui_to_discovery, queue_discovery_to_ui, config, lambda: start_discovery_process())
+    # UI-Prozess auf den Kern legen, den die Kinder freilassen
+    pin_ui()
+
+    ui_cli.run_cli(queues.ui_to_net, queues.net_to_ui, queues.ui_to_discovery, queues.discovery_to_ui, config, lambda: start_discovery_process())
 
     # Prozesse beenden, sobald CLI endet
-    p_net.terminate()
-    p_net.join()
-    if p_disc is not None:
-       p_disc.terminate()
-       p_disc.join()
-       unmark_discovery()
+    stop_processes([p for p in (p_net, p_disc) if p is not None])
 
     print("[INFO] Prozesse nach CLI-Ende sauber beendet.")
 
+def stop_processes(processes, timeout=3.0):
+    """
+    @brief Beendet alle Kindprozesse und wartet gemeinsam auf ihr Ende.
+    @details
+    Alle Prozesse bekommen zuerst SIGTERM, danach wird mit einem einzigen
+    multiprocessing.connection.wait() auf alle Sentinels gleichzeitig gewartet.
+    Wer nach `timeout` Sekunden noch lebt, wird mit kill() beendet.
+    @param processes Gestartete multiprocessing.Process-Objekte
+    @param timeout Maximale Wartezeit in Sekunden
+    """
+    for p in processes:
+        p.terminate()
+
+    sentinels = {p.sentinel: p for p in processes}
+    while sentinels:
+        done = wait(list(sentinels), timeout)
+        if not done:
+            break
+        for s in done:
+            sentinels.pop(s).join()
+
+    for p in sentinels.values():
+        print(f"[WARNUNG] {p.name} reagiert nicht, wird hart beendet.")
+        p.kill()
+        p.join()
+
 # === Einstiegspunkt ===
 if __name__ == "__main__":
     try:
-        multiprocessing.set_start_method("spawn")
+        if sys.platform == "win32":
+            multiprocessing.set_start_method("spawn")
+        else:
+            # forkserver: schwere Importe einmal im Server, jedes Kind ist danach nur ein fork()
+            multiprocessing.set_start_method("forkserver")
+            # ipc legt beim Import keine Queues an und kann daher mit vorgeladen werden
+            multiprocessing.set_forkserver_preload(["network", "discovery", "utils.config", "ipc"])
     except RuntimeError:
         pass
 
@@ -8,14 +8,70 @@
 ## - empfängt und sendet Bildnachrichten per TCP
 ## - verarbeitet IAM-Nachrichten zur Peer-Erkennung
 
-import socket, threading, time
-from utils.slcp import build_message, parse_message
+import os, selectors, signal, socket, threading, time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from utils.slcp import build_message_bytes, parse_message, escape_param, MAX_MESSAGE_LENGTH
 from utils.config import get_config_value
 from utils.image_tools import save_image
-from utils.network_utils import detect_broadcast_address
+from utils.network_utils import detect_broadcast_address, make_batch_receiver
+from utils.logger import get_logger, shutdown_logging
 
-peers, peer_status = {}, {}
-joined = False
+log = get_logger("network")
+
+SOCKET_BUFFER_SIZE = 12 * 1024 * 1024  ## 12 MiB Puffer gegen Paketverlust bei JOIN-/MSG-Stößen
+TCP_WORKERS = 16        ## Max. gleichzeitig bearbeitete TCP-Verbindungen
+TCP_QUEUED = 16         ## Max. angenommene Verbindungen, die auf einen freien Worker warten
+TCP_HEADER_TIMEOUT = 5.0  ## Sekunden, in denen der komplette Header angekommen sein muss
+TCP_TIMEOUT = 30.0      ## Sekunden ohne Daten (beim Bildinhalt), bevor eine Verbindung aufgegeben wird
+MAX_IMAGE_SIZE = 64 * 1024 * 1024  ## Größere (oder leere) IMG-Angaben werden abgelehnt, bevor Speicher belegt wird
+PEER_TTL = 300.0        ## Abgemeldete Peers werden nach dieser Zeit (Sekunden) entfernt
+PEER_PRUNE_INTERVAL = 60.0
+
+## Ein Eintrag pro Peer: Adresse (ip, port), Online-Status (JOIN/LEAVE) und letzter Kontakt (monotonic)
+PeerEntry = namedtuple("PeerEntry", "addr online seen")
+
+class PeerTable:
+    ## @brief Peer-Tabelle (Handle -> PeerEntry), die von mehreren Threads beschrieben wird
+    ## @details Schreibzugriffe laufen unter einem Lock, damit z. B. LEAVE (lesen + ersetzen)
+    ##          nicht mit einem gleichzeitigen JOIN/IAM kollidiert – auch ohne GIL.
+
+    def __init__(self):
+        self._peers = {}
+        self._lock = threading.Lock()
+
+    def set(self, handle, addr):
+        ## @brief Trägt einen Peer als online mit Adresse (ip, port) ein
+        with self._lock:
+            self._peers[handle] = PeerEntry(addr, True, time.monotonic())
+
+    def leave(self, handle):
+        ## @brief Markiert einen bekannten Peer als offline
+        with self._lock:
+            if (e := self._peers.get(handle)):
+                self._peers[handle] = e._replace(online=False, seen=time.monotonic())
+
+    def touch(self, handle):
+        ## @brief Aktualisiert den Zeitpunkt des letzten Kontakts (z. B. bei MSG)
+        with self._lock:
+            if (e := self._peers.get(handle)):
+                self._peers[handle] = e._replace(seen=time.monotonic())
+
+    def prune(self, max_age):
+        ## @brief Entfernt abgemeldete Peers, deren letzter Kontakt älter als max_age ist
+        ## @details Online-Peers bleiben erhalten: SLCP kennt keinen Heartbeat, ein stiller Peer ist nicht zwingend weg.
+        ## @return Liste der entfernten Handles
+        cutoff = time.monotonic() - max_age
+        with self._lock:
+            stale = [h for h, e in self._peers.items() if not e.online and e.seen < cutoff]
+            for h in stale:
+                del self._peers[h]
+        return stale
+
+    def get(self, handle):
+        ## @return PeerEntry oder None
+        return self._peers.get(handle)
 
 def run_network(queue_ui_in, queue_ui_out, queue_disc_in, config):
     ## @brief Startet alle Netzwerk-Komponenten
@@ -26,128 +82,331 @@ def run_network(queue_ui_in, queue_ui_out, queue_disc_in, config):
 
     port, handle = config["port"], config["handle"]
 
+    ## Zustand pro Aufruf statt Modul-Globals: schnelle Closure-Zugriffe, mehrere Instanzen möglich
+    peers = PeerTable()
+    joined = threading.Event()  ## gesetzt nach JOIN, gelöscht nach LEAVE
+
     udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    ## Kernel begrenzt ggf. auf net.core.rmem_max/wmem_max
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
     udp.bind(("", port))
 
     tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    ## Vor listen() gesetzt, damit angenommene Bildverbindungen den Puffer erben
+    tcp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
     tcp.bind(("", port))
     tcp.listen(10)
+    tcp.setblocking(False)  ## accept() darf den gemeinsamen Selector-Thread nie blockieren
+
+    ## Broadcast-Ziel einmal beim Start bestimmen statt bei jedem JOIN/LEAVE
+    bcast_addr = (detect_broadcast_address(), config["whoisport"])
+
+    ## dontwait: vom Selector geweckt – ist das Datagramm schon weg, nicht hängen bleiben
+    recv_batch = make_batch_receiver(udp, dontwait=True)
+
+    ## Handle ist für die Prozesslaufzeit fest: Präfix des IMG-Headers nur einmal kodieren
+    img_prefix = ("IMG " + escape_param(handle) + " ").encode()
+
+    def img_header(size, comment):
+        ## @brief Baut den kodierten IMG-Header aus dem vorberechneten Präfix
+        ## @return Header als bytes oder None, wenn er die SLCP-Maximallänge überschreitet
+        header = img_prefix + escape_param(f"{size}|{comment}").encode() + b"\n"
+        return header if len(header) <= MAX_MESSAGE_LENGTH else None
+
+    @lru_cache(maxsize=8)
+    def autoreply_bytes(reply):
+        ## @brief Kodierte Autoreply-Nachricht (gecacht, solange sich der Text nicht ändert)
+        return build_message_bytes("MSG", handle, "[autoreply] " + reply)
+
+    def on_join(p, addr):
+        peers.set(p[0], (addr[0], int(p[1])))
+
+    def on_leave(p, addr):
+        peers.leave(p[0])
+        drop_udp_conn(p[0])
+
+    ## Textnachrichten eines recvmmsg-Stapels, gesammelt für einen einzigen Queue-Put
+    ui_pending = []
+
+    def on_msg(p, addr):
+        peers.touch(p[0])
+        if joined.is_set():
+            ui_pending.append({"type": "text", "from": p[0], "text": p[1], "is_self": False})
+        elif (reply := get_config_value("autoreply")) and p[0] != handle:
+            send_udp(p[0], autoreply_bytes(reply), True)
+
+    def on_iam(p, addr):
+        peers.set(p[0], (p[1], int(p[2])))
+
+    ## Befehl → Handler: ein Hash-Lookup statt elif-Kette
+    ## (WHOIS trägt wie JOIN Handle + Port des Absenders)
+    dispatch = {"JOIN": on_join, "LEAVE": on_leave, "MSG": on_msg, "WHOIS": on_join, "IAM": on_iam}
 
     def receive_udp():
-        ## @brief Verarbeitet alle eingehenden SLCP-Nachrichten über UDP
-        ## @details Erkennt JOIN, LEAVE, MSG, WHOIS, IAM
-        while True:
+        ## @brief Verarbeitet alle bereitliegenden SLCP-Nachrichten über UDP
+        ## @details Erkennt JOIN, LEAVE, MSG, WHOIS, IAM.
+        ##          Liest per recvmmsg() mehrere Datagramme mit einem Systemaufruf (Linux).
+        try: batch = recv_batch()
+        except OSError as e:
+            ## Kein sleep(): der Selector-Thread bedient auch TCP-Verbindungen. Ein gemeldeter
+            ## Socketfehler (z. B. ICMP) wird mit dem recv abgeholt und steht danach nicht mehr an.
+            log.warning("[UDP-Fehler] Empfang fehlgeschlagen: %s", e)
+            return
+        for msg, addr in batch:
             try:
-                msg, addr = udp.recvfrom(1024)
-                parsed = parse_message(msg.decode("utf-8"))
-                cmd, p = parsed["command"], parsed["params"]
-                
-                if cmd == "JOIN":
-                    peers[p[0]] = (addr[0], int(p[1]))
-                    peer_status[p[0]] = True
-                elif cmd == "LEAVE":
-                    peer_status[p[0]] = False
-                elif cmd == "MSG" and joined:
-                    queue_ui_out.put({"type": "text", "from": p[0], "text": p[1], "is_self": False})
-                elif cmd == "MSG":
-                    if (reply := get_config_value("autoreply")) and p[0] != handle:
-                        m = build_message("MSG", handle, "[autoreply] " + reply)
-                        send_udp(p[0], m, True)
-                elif cmd == "WHOIS":
-                    peers[p[0]] = (addr[0], int(p[1]))
-                elif cmd == "IAM":
-                    peers[p[0]] = (p[1], int(p[2]))
-            except: pass
-            time.sleep(0.1)
-
-    def tcp_listener():
-        ## @brief Lauscht auf eingehende TCP-Verbindungen (z. B. für Bildtransfer)
+                parsed = parse_message(msg)  ## nimmt bytes direkt an
+                if (h := dispatch.get(parsed["command"])):
+                    h(parsed["params"], addr)
+            except (ValueError, IndexError) as e:
+                log.warning("[UDP-Fehler] Ungültige Nachricht von %s: %s", addr[0], e)
+            except OSError as e:
+                ## z. B. Autoreply an einen Peer, der gerade gegangen ist – erwartbar, nur im Debug-Log
+                log.debug("[UDP-Fehler] %s von %s", e, addr[0])
+
+        ## Mehrere Nachrichten aus einem Stapel als ein "batch"-Eintrag: ein Pickle/Pipe-Write statt vieler
+        try:
+            if len(ui_pending) == 1:
+                queue_ui_out.put(ui_pending[0])
+            elif ui_pending:
+                queue_ui_out.put({"type": "batch", "items": ui_pending[:]})
+        finally:
+            ui_pending.clear()
+
+    ## Fester Thread-Pool statt eines neuen Threads pro Verbindung
+    tcp_pool = ThreadPoolExecutor(max_workers=TCP_WORKERS, thread_name_prefix="tcp")
+    ## Begrenzt laufende + wartende Verbindungen: die Warteschlange des Pools selbst ist unbegrenzt
+    tcp_slots = threading.BoundedSemaphore(TCP_WORKERS + TCP_QUEUED)
+
+    def accept_tcp():
+        ## @brief Nimmt eine eingehende TCP-Verbindung an (z. B. für Bildtransfer)
+        ## @details Sind alle Worker belegt und TCP_QUEUED Verbindungen in der Warteschlange,
+        ##          wird die neue Verbindung sofort geschlossen statt unbegrenzt gepuffert.
+        ##          Der Listener ist nicht-blockierend: Wurde die Verbindung zwischen select()
+        ##          und accept() zurückgesetzt, kommt BlockingIOError statt eines Hängers.
+        try:
+            conn, addr = tcp.accept()
+        except OSError: return
+        if not tcp_slots.acquire(blocking=False):
+            log.warning("[TCP] Zu viele offene Verbindungen – %s abgewiesen", addr[0])
+            conn.close()
+            return
+        try:
+            tcp_pool.submit(handle_tcp, conn, time.monotonic() + TCP_HEADER_TIMEOUT)
+        except RuntimeError:  ## Pool bereits heruntergefahren
+            tcp_slots.release()
+            conn.close()
+
+    def socket_loop():
+        ## @brief Wartet in einem Thread gleichzeitig auf UDP-Datagramme und TCP-Verbindungen
+        ## @details selectors wählt epoll (Linux), kqueue (macOS) bzw. select (Windows).
+        sel = selectors.DefaultSelector()
+        sel.register(udp, selectors.EVENT_READ, receive_udp)
+        sel.register(tcp, selectors.EVENT_READ, accept_tcp)
         while True:
             try:
-                conn, _ = tcp.accept()
-                threading.Thread(target=handle_tcp, args=(conn,), daemon=True).start()
-            except: continue
+                for key, _ in sel.select():
+                    key.data()
+            except Exception:
+                ## Ein Fehler darf den gemeinsamen Empfangs-Thread nicht beenden
+                log.exception("[Socket-Fehler]")
 
-    def handle_tcp(conn):
+    def handle_tcp(conn, deadline):
         ## @brief Verarbeitet eine einzelne TCP-Verbindung
-        ## @details Empfängt Header + Daten (IMG oder MSG) und sendet an die UI weiter
+        ## @details Empfängt Header + Daten (IMG oder MSG) und sendet an die UI weiter.
+        ##          Für den Header gilt eine feste Frist (TCP_HEADER_TIMEOUT) ab Annahme, damit ein
+        ##          Absender, der Byte für Byte tröpfelt, keinen Worker lange blockiert;
+        ##          erst für den Bildinhalt gilt TCP_TIMEOUT pro recv().
+        ## @param conn Angenommene Verbindung
+        ## @param deadline Zeitpunkt (monotonic), bis zu dem der Header vollständig sein muss
         try:
-            header = conn.recv(512).decode().strip()
+            ## Header bis zum Zeilenumbruch lesen; was danach im Puffer liegt, sind schon Bilddaten
+            buf = b""
+            while b"\n" not in buf and len(buf) < MAX_MESSAGE_LENGTH:
+                left = deadline - time.monotonic()
+                if left <= 0: raise socket.timeout("Header-Frist abgelaufen")
+                conn.settimeout(left)
+                chunk = conn.recv(MAX_MESSAGE_LENGTH)
+                if not chunk: break
+                buf += chunk
+            conn.settimeout(TCP_TIMEOUT)
+            header, _, rest = buf.partition(b"\n")
             parsed = parse_message(header)
             if parsed["command"] == "IMG":
                 sender, info = parsed["params"]
-                size, comment = (info + "|").split("|", 1)[:2]
-                img = b""
-                while len(img) < int(size): img += conn.recv(1024)
+                size, _, comment = info.partition("|")
+                size = int(size)
+                ## Größe stammt vom Absender: erst prüfen, dann allokieren
+                if not 0 < size <= MAX_IMAGE_SIZE:
+                    log.warning("[TCP-Fehler] Ungültige Bildgröße %d von %s", size, sender)
+                    return
+                ## Vorallokierter Puffer statt img += recv(): kein erneutes Kopieren pro Block
+                img = bytearray(size)
+                rest = rest[:size]
+                img[:len(rest)] = rest
+                view, got = memoryview(img), len(rest)
+                while got < size:
+                    n = conn.recv_into(view[got:], size - got)
+                    if not n:  ## Verbindung vorzeitig geschlossen – Bild unvollständig
+                        log.warning("[TCP-Fehler] Bild von %s unvollständig (%d von %d Bytes)", sender, got, size)
+                        return
+                    got += n
                 path = save_image(img, config["imagepath"], sender)
                 queue_ui_out.put({"type": "image", "from": sender, "path": path, "comment": comment.strip()})
             elif parsed["command"] == "MSG":
                 queue_ui_out.put({"type": "text", "from": parsed["params"][0], "text": parsed["params"][1]})
-        except: pass
-        finally: conn.close()
+        except (ValueError, IndexError) as e:
+            log.warning("[TCP-Fehler] Ungültiger Header: %s", e)
+        except OSError as e:
+            log.warning("[TCP-Fehler] Empfang abgebrochen: %s", e)
+        except Exception:
+            log.warning("[TCP-Fehler] Verbindung nicht verarbeitet", exc_info=True)
+        finally:
+            conn.close()
+            tcp_slots.release()
 
     def handle_ui():
         ## @brief Verarbeitet SLCP-Befehle, die von der UI gesendet wurden
         ## @details Erkennt JOIN, LEAVE, MSG und IMG Befehle
-        global joined
         while True:
             try:
-                if queue_ui_in.empty(): continue
-                item = queue_ui_in.get_nowait()
+                item = queue_ui_in.get()  ## blockiert, bis die UI etwas schickt
                 if item["type"] == "broadcast":
                     cmd = parse_message(item["data"])["command"]
-                    joined = cmd == "JOIN"
-                    ip = detect_broadcast_address()
-                    udp.sendto(item["data"].encode(), (ip, config["whoisport"]))
+                    if cmd == "JOIN": joined.set()
+                    else: joined.clear()
+                    udp.sendto(item["data"].encode(), bcast_addr)
                 elif item["type"] == "direct_text":
                     send_udp(item["to"], item["data"])
                 elif item["type"] == "direct_image":
                     send_tcp(item["to"], item["binary"], item.get("comment", ""))
-            except: pass
-            time.sleep(0.1)
+                elif item["type"] == "direct_image_file":
+                    send_tcp_file(item["to"], item["path"], item.get("comment", ""))
+            except Exception as e:
+                log.warning("[UI-Fehler] %s", e, exc_info=True)
 
     def handle_discovery():
         ## @brief Verarbeitet IAM-Nachrichten, die vom Discovery-Modul kommen
         while True:
             try:
-                if queue_disc_in.empty(): continue
-                i = queue_disc_in.get_nowait()
+                i = queue_disc_in.get()
                 if i["type"] == "iam":
-                    peers[i["handle"]] = (i["ip"], i["port"])
-            except: pass
-            time.sleep(0.1)
+                    peers.set(i["handle"], (i["ip"], i["port"]))
+            except Exception as e:
+                log.warning("[Discovery-Fehler] %s", e, exc_info=True)
+
+    ## Verbundene UDP-Sockets pro Peer: Route wird einmal beim connect() aufgelöst
+    udp_conns, udp_conns_lock = {}, threading.Lock()  ## handle -> (addr, socket)
+
+    def drop_udp_conn(to):
+        ## @brief Schließt den verbundenen Socket eines Peers (z. B. nach LEAVE)
+        with udp_conns_lock:
+            c = udp_conns.pop(to, None)
+        if c: c[1].close()
 
     def send_udp(to, msg, allow=False):
         ## @brief Sendet UDP-Nachricht an Peer
+        ## @details Nutzt einen verbundenen Socket pro Peer; ändert sich dessen Adresse
+        ##          (neues JOIN/IAM), wird der Socket neu aufgebaut.
         ## @param to Empfänger-Handle
-        ## @param msg SLCP-formatierte Nachricht
+        ## @param msg SLCP-formatierte Nachricht (str oder bereits kodierte bytes)
         ## @param allow Wenn True, auch senden wenn nicht "joined"
-        if not joined and not allow: return
-        if to in peers:
-            try: udp.sendto(msg.encode(), peers[to])
-            except: pass
+        if not joined.is_set() and not allow: return
+        if not (e := peers.get(to)): return
+        try:
+            with udp_conns_lock:
+                c = udp_conns.get(to)
+                if c is None or c[0] != e.addr:
+                    if c: c[1].close()
+                    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    s.connect(e.addr)
+                    c = udp_conns[to] = (e.addr, s)
+            c[1].send(msg if isinstance(msg, bytes) else msg.encode())
+        except OSError: drop_udp_conn(to)
+
+    def send_gather(s, header, data):
+        ## @brief Sendet Header und Nutzdaten mit einem sendmsg()-Aufruf (Scatter/Gather)
+        ## @details Kein header + data: die Bilddaten werden nicht kopiert.
+        ##          Teilweise Sendungen werden mit sendall() vervollständigt; ohne sendmsg (Windows) zwei sendall().
+        if not hasattr(s, "sendmsg"):
+            s.sendall(header); s.sendall(data)
+            return
+        sent = s.sendmsg([header, data])
+        if sent < len(header):
+            s.sendall(header[sent:])
+            s.sendall(data)
+        elif sent < len(header) + len(data):
+            s.sendall(memoryview(data)[sent - len(header):])
+
+    def open_tcp(addr):
+        ## @brief Baut die ausgehende TCP-Verbindung für einen Bildtransfer auf
+        ## @details Großer Sendepuffer für schnelle Bildübertragung, TCP_NODELAY damit der kurze
+        ##          IMG-Header nicht durch Nagle auf ein ACK warten muss.
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            s.connect(addr)
+        except OSError:
+            s.close()
+            raise
+        return s
 
     def send_tcp(to, data, comment=""):
         ## @brief Sendet Binärdaten (z. B. Bild) per TCP
         ## @param to Ziel-Handle
         ## @param data Binärinhalt
         ## @param comment Optionaler Textkommentar
-        if not joined or to not in peers: return
+        if not joined.is_set() or not (e := peers.get(to)): return
+        if not (header := img_header(len(data), comment)): return
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect(peers[to])
-            header = build_message("IMG", config["handle"], f"{len(data)}|{comment}")
-            s.sendall(header.encode())
-            time.sleep(0.05)
-            s.sendall(data)
-            s.close()
-        except: pass
+            with open_tcp(e.addr) as s:
+                send_gather(s, header, data)
+        except OSError as err:
+            log.warning("[TCP-Fehler] Bild an %s nicht gesendet: %s", to, err)
+
+    def send_tcp_file(to, path, comment=""):
+        ## @brief Sendet eine Bilddatei per TCP direkt aus dem Dateisystem
+        ## @details Nutzt socket.sendfile(), die Datei wird nicht in den Speicher geladen.
+        ##          Die Größe kommt per fstat() von der bereits geöffneten Datei und begrenzt auch
+        ##          sendfile(): Header und Byte-Strom stimmen überein, selbst wenn die Datei
+        ##          währenddessen wächst (schrumpft sie, erkennt der Empfänger das unvollständige Bild).
+        ## @param to Ziel-Handle
+        ## @param path Pfad zur Bilddatei
+        ## @param comment Optionaler Textkommentar
+        if not joined.is_set() or not (e := peers.get(to)): return
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if not 0 < size <= MAX_IMAGE_SIZE:
+                    log.warning("[TCP-Fehler] Bild %s hat ungültige Größe (%d Bytes)", path, size)
+                    return
+                if not (header := img_header(size, comment)): return
+                with open_tcp(e.addr) as s:
+                    s.sendall(header)
+                    s.sendfile(f, 0, size)
+        except OSError as err:
+            log.warning("[TCP-Fehler] Bild an %s nicht gesendet: %s", to, err)
 
-    threading.Thread(target=receive_udp, daemon=True).start()
-    threading.Thread(target=tcp_listener, daemon=True).start()
+    threading.Thread(target=socket_loop, daemon=True).start()
     threading.Thread(target=handle_ui, daemon=True).start()
     threading.Thread(target=handle_discovery, daemon=True).start()
-    while True: time.sleep(1)
\ No newline at end of file
+    ## Hauptthread räumt periodisch abgemeldete Peers (und deren UDP-Sockets) auf,
+    ## bis SIGTERM/SIGINT kommt (wie in discovery.py)
+    stop = threading.Event()
+    try:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+    except ValueError:
+        pass  ## nicht im Hauptthread gestartet → Prozessende beendet uns
+    while not stop.wait(PEER_PRUNE_INTERVAL):
+        for h in peers.prune(PEER_TTL):
+            drop_udp_conn(h)
+    ## Aufräumen, damit wartende Log-Einträge nicht mit dem Prozess verloren gehen
+    tcp_pool.shutdown(wait=False)
+    udp.close()
+    tcp.close()
+    shutdown_logging()
\ No newline at end of file
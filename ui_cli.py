@@ -10,11 +10,10 @@ Beide Varianten unterstützen Text- und Bildnachrichten, Konfiguration, WHOIS un
 """
 
 import threading
-import time
 import os
+from queue import Empty
 
 from utils.config import update_config_field
-from utils.image_tools import read_image_bytes, get_image_size, open_image
 from utils.slcp import build_message
 
 def run_cli(queue_to_net, queue_from_net, queue_to_disc, queue_from_disc, config, start_discovery_callback):
@@ -40,45 +39,164 @@ def run_cli(queue_to_net, queue_from_net, queue_to_disc, queue_from_disc, config
     print(f"Willkommen im BSRN-Chat, {config['handle']}!")
     print("Verfügbare Befehle: join, leave, msg, img, whois, autoreply, config, start_discovery, exit")
 
+    # JOIN/LEAVE sind für diesen Client konstant → einmalig bauen
+    msg_join = build_message("JOIN", config["handle"], config["port"])
+    msg_leave = build_message("LEAVE", config["handle"])
+
     # === Eingehende Nachrichten parallel anzeigen ===
     peers = {}  # Lokale Peer-Liste für CLI
 
-    def listener():
+    def listener_net():
         """
-        @brief Hintergrund-Thread zur asynchronen Anzeige von Nachrichten und WHOIS-Antworten.
+        @brief Hintergrund-Thread zur asynchronen Anzeige von Text- und Bildnachrichten.
+        @details Blockiert auf der Queue, bis eine Nachricht da ist, und leert sie danach
+                 mit get_nowait(), damit ein Schwall von Nachrichten in einem Durchgang
+                 angezeigt wird.
         """
+        def show(msg):
+            if msg["type"] == "text":
+               text = msg["text"]
+               sender = msg["from"]
+               if text.startswith("[autoreply]"):
+                  print(f"\n[Auto-Reply von {sender}] {text.replace('[autoreply] ', '', 1)}")
+               else:
+                  print(f"\n[Nachricht von {sender}] {text}")
+
+            elif msg["type"] == "image":
+                print(f"\n[Empfangenes Bild von {msg['from']}] gespeichert: {msg['path']}")
+
         while True:
             try:
-                # Nachrichten vom Netzwerkprozess
-                if not queue_from_net.empty():
-                    msg = queue_from_net.get_nowait()
+                # Nachrichten vom Netzwerkprozess (einzeln oder gebündelt)
+                msg = queue_from_net.get()
+                while True:
+                    if msg["type"] == "batch":
+                        for m in msg["items"]:
+                            show(m)
+                    else:
+                        show(msg)
+                    try:
+                        msg = queue_from_net.get_nowait()
+                    except Empty:
+                        break
 
-                    if msg["type"] == "text":
-                       text = msg["text"]
-                       sender = msg["from"]
-                       if text.startswith("[autoreply]"):
-                          print(f"\n[Auto-Reply von {sender}] {text.replace('[autoreply] ', '', 1)}")
-                       else:
-                          print(f"\n[Nachricht von {sender}] {text}")
-
-                    elif msg["type"] == "image":
-                        print(f"\n[Empfangenes Bild von {msg['from']}] gespeichert: {msg['path']}")
+            except Exception:
+                continue
 
+    def listener_disc():
+        """
+        @brief Hintergrund-Thread zur asynchronen Anzeige von WHOIS-Antworten.
+        @details Wie listener_net(): einmal blockierend warten, dann die Queue leeren.
+        """
+        while True:
+            try:
                 # IAM-Antworten vom Discoveryprozess
-                if not queue_from_disc.empty():
-                    iam = queue_from_disc.get_nowait()
+                iam = queue_from_disc.get()
+                while True:
                     handle = iam['handle']
                     ip = iam['ip']
                     port = iam['port']
                     peers[handle] = (ip, port)  # Peer speichern!
                     print(f"\n[WHOIS-Antwort] {handle} ist erreichbar unter {ip}:{port}")
+                    try:
+                        iam = queue_from_disc.get_nowait()
+                    except Empty:
+                        break
 
             except Exception:
                 continue
-            time.sleep(0.1)
 
-    # Thread starten
-    threading.Thread(target=listener, daemon=True).start()
+    # Threads starten
+    threading.Thread(target=listener_net, daemon=True).start()
+    threading.Thread(target=listener_disc, daemon=True).start()
+
+    # === Befehle ===
+    # Jeder Befehl ist eine eigene Funktion; die Eingabeschleife schlägt sie im
+    # Dictionary nach, statt eine if/elif-Kette zu durchlaufen.
+    # Übergeben wird der Rest der Eingabe nach dem Befehlswort (args), jeder Befehl
+    # zerlegt ihn nur so weit wie nötig (split mit maxsplit).
+    # Rückgabe True beendet die Eingabeschleife.
+
+    def cmd_join(args):
+        """JOIN – Anmelden im Netzwerk"""
+        queue_to_net.put({"type": "broadcast", "data": msg_join})
+        queue_to_disc.put({"data": msg_join})
+
+    def cmd_leave(args):
+        """LEAVE – Abmelden"""
+        queue_to_net.put({"type": "broadcast", "data": msg_leave})
+        queue_to_disc.put({"data": msg_leave})
+
+    def cmd_msg(args):
+        """MSG – Textnachricht an anderen Benutzer"""
+        parts = args.split(None, 1)
+        if len(parts) < 2:
+            print("Syntax: msg <Empfänger> <Nachricht>")
+            return
+        to, text = parts
+        msg = build_message("MSG", config["handle"], text)   # handle = Absender
+        queue_to_net.put({"type": "direct_text", "to": to, "data": msg})
+
+    def cmd_img(args):
+        """IMG – Bild versenden"""
+        parts = args.split()
+        if len(parts) != 2:
+            print("Syntax: img <Empfänger> <Bildpfad>")
+            return
+        to, path = parts
+        if not os.path.isfile(path):
+            print("Bildpfad existiert nicht.")
+            return
+        # Nur den Pfad übergeben: der Netzwerkprozess bestimmt die Größe an der geöffneten
+        # Datei selbst und streamt sie direkt
+        queue_to_net.put({"type": "direct_image_file", "to": to, "path": os.path.abspath(path)})
+
+    def cmd_whois(args):
+        """WHOIS – Suche nach Benutzer im Netzwerk"""
+        parts = args.split()
+        if len(parts) != 1:
+            print("Syntax: whois <Benutzername>")
+            return
+        target = parts[0]
+        msg = build_message("WHOIS", target)
+        queue_to_disc.put({"data": msg})
+
+    def cmd_autoreply(args):
+        """AUTOREPLY – automatische Antwort setzen"""
+        if not args:
+            print("Syntax: autoreply <Text>")
+            return
+        text = args
+        update_config_field("autoreply", text)
+        print(f"Autoreply gesetzt auf: {text}")
+
+    def cmd_config(args):
+        """CONFIG – Zeige aktuelle Konfiguration"""
+        print("Aktuelle Konfiguration:")
+        for key, val in config.items():
+            print(f"  {key}: {val}")
+
+    def cmd_exit(args):
+        """EXIT – Beenden des Programms"""
+        print("Beende Chat...")
+        queue_to_net.put({"type": "broadcast", "data": msg_leave})
+        return True
+
+    def cmd_start_discovery(args):
+        """START_DISCOVERY – Discovery-Prozess (neu) starten"""
+        start_discovery_callback()
+
+    commands = {
+        "join": cmd_join,
+        "leave": cmd_leave,
+        "msg": cmd_msg,
+        "img": cmd_img,
+        "whois": cmd_whois,
+        "autoreply": cmd_autoreply,
+        "config": cmd_config,
+        "exit": cmd_exit,
+        "start_discovery": cmd_start_discovery,
+    }
 
     # === Haupt-Eingabeschleife ===
     while True:
@@ -87,86 +205,16 @@ def run_cli(queue_to_net, queue_from_net, queue_to_disc, queue_from_disc, config
             if not user_input:
                 continue
 
-            tokens = user_input.split()
-            cmd = tokens[0].lower()
-
-            # JOIN – Anmelden im Netzwerk
-            if cmd == "join":
-                msg = build_message("JOIN", config["handle"], config["port"])
-                queue_to_net.put({"type": "broadcast", "data": msg})
-                queue_to_disc.put({"data": msg})  
-
-
-            # LEAVE – Abmelden
-            elif cmd == "leave":
-                msg = build_message("LEAVE", config["handle"])
-                queue_to_net.put({"type": "broadcast", "data": msg})
-                queue_to_disc.put({"data": msg})
-
-            # MSG – Textnachricht an anderen Benutzer
-            elif cmd == "msg":
-                if len(tokens) < 3:
-                   print("Syntax: msg <Empfänger> <Nachricht>")
-                   continue
-                to = tokens[1]
-                text = " ".join(tokens[2:])
-                msg = build_message("MSG", config["handle"], text)   # handle = Absender
-                queue_to_net.put({"type": "direct_text", "to": to, "data": msg})
-
-            # IMG – Bild versenden
-            elif cmd == "img":
-                if len(tokens) != 3:
-                    print("Syntax: img <Empfänger> <Bildpfad>")
-                    continue
-                to = tokens[1]
-                path = tokens[2]
-                if not os.path.exists(path):
-                    print("Bildpfad existiert nicht.")
-                    continue
-                data = read_image_bytes(path)
-                size = get_image_size(path)
-                msg = build_message("IMG", to, size)
-                queue_to_net.put({"type": "direct_image", "to": to, "data": msg, "binary": data})
-
-            # WHOIS – Suche nach Benutzer im Netzwerk
-            elif cmd == "whois":
-                if len(tokens) != 2:
-                    print("Syntax: whois <Benutzername>")
-                    continue
-                target = tokens[1]
-                msg = build_message("WHOIS", target)
-                queue_to_disc.put({"data": msg})
-
-            # AUTOREPLY – automatische Antwort setzen
-            elif cmd == "autoreply":
-                if len(tokens) < 2:
-                    print("Syntax: autoreply <Text>")
-                    continue
-                text = " ".join(tokens[1:])
-                update_config_field("autoreply", text)
-                print(f"Autoreply gesetzt auf: {text}")
-
-            # CONFIG – Zeige aktuelle Konfiguration
-            elif cmd == "config":
-                print("Aktuelle Konfiguration:")
-                for key, val in config.items():
-                    print(f"  {key}: {val}")
-
-            # EXIT – Beenden des Programms
-            elif cmd == "exit":
-                print("Beende Chat...")
-                msg = build_message("LEAVE", config["handle"])
-                queue_to_net.put({"type": "broadcast", "data": msg})
-                break
-
-            elif cmd == "start_discovery":
-                start_discovery_callback()
-
-            else:
+            parts = user_input.split(None, 1)
+            args = parts[1] if len(parts) > 1 else ""
+            handler = commands.get(parts[0].lower())
+            if handler is None:
                 print("Unbekannter Befehl.")
+            elif handler(args):
+                break
 
         except KeyboardInterrupt:
             print("\n[INTERRUPT] Beende Chat...")
             break
         except Exception as e:
-            print(f"[Fehler] {e}")
\ No newline at end of file
+            print(f"[Fehler] {e}")
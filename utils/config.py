@@ -3,13 +3,118 @@
 @brief Verwaltet zentral die config.toml für Clients und Defaults (SLCP).
 """
 
-import os, toml, socket
+import os, socket, copy
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:      # Windows: kein flock
+    fcntl = None
+
+# Schnellere TOML-Bibliotheken verwenden, wenn vorhanden:
+# tomllib (Standardbibliothek ab Python 3.11) zum Lesen, tomli_w zum Schreiben.
+# Sonst wie bisher das Paket „toml“.
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+try:
+    import tomli_w
+except ImportError:
+    tomli_w = None
+if tomllib is None or tomli_w is None:
+    import toml
 from threading import Lock
 from pathlib import Path
 
 CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'config.toml'))
+LOCK_PATH = CONFIG_PATH + '.lock'
 _lock = Lock()
 
+# Zuletzt geparste Konfiguration; gültig, solange sich mtime/Größe/Inode der Datei nicht ändern
+# (andere Prozesse, z. B. die UI mit „autoreply“, schreiben dieselbe Datei; jedes
+# os.replace() erzeugt einen neuen Inode, auch wenn mtime und Größe gleich bleiben)
+_cache = None
+_cache_mtime = None
+_clients_by_handle = {}  # Handle -> Client-Eintrag, wird mit _cache neu aufgebaut (nicht gespeichert)
+
+@contextmanager
+def _config_lock():
+    """
+    @brief Sperrt die Konfiguration für Threads dieses Prozesses und für andere Prozesse.
+    @details Zusätzlich zu _lock ein fcntl.flock() auf einer Lock-Datei neben config.toml –
+             so können zwei gleichzeitig gestartete Clients nicht denselben Port vergeben.
+             Nur für Lesen–Ändern–Schreiben nötig; reine Lesezugriffe nehmen nur _lock,
+             da _save_locked() atomar per os.replace() schreibt.
+             Lässt sich die Lock-Datei nicht anlegen (z. B. schreibgeschütztes Verzeichnis),
+             bleibt es beim Thread-Lock.
+    """
+    with _lock:
+        try:
+            fd = open(LOCK_PATH, 'a') if fcntl is not None else None
+        except OSError:
+            fd = None
+        if fd is None:
+            yield
+            return
+        with fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+def _load_locked() -> dict:
+    """
+    @brief Lädt die Konfiguration (aus dem Cache, wenn die Datei unverändert ist).
+    @details Der Aufrufer muss _lock oder _config_lock() halten. Zurück kommt das gecachte
+             Dictionary selbst – wer es verändern oder nach außen geben will, kopiert es vorher.
+    """
+    global _cache, _cache_mtime, _clients_by_handle
+    try:
+        st = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Datei nicht gefunden: {CONFIG_PATH}")
+    mtime = (st.st_mtime_ns, st.st_size, st.st_ino)
+    if _cache is None or mtime != _cache_mtime:
+        if tomllib is not None:
+            with open(CONFIG_PATH, 'rb') as f:
+                _cache = tomllib.load(f)
+        else:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                _cache = toml.load(f)
+        _cache_mtime = mtime
+        _clients_by_handle = {c["handle"]: c for c in _cache.get("clients", [])}
+    return _cache
+
+def _save_locked(config: dict):
+    """
+    @brief Schreibt die Konfiguration und aktualisiert den Cache.
+    @details Der Aufrufer muss _config_lock() halten. Geschrieben wird in eine temporäre
+             Datei, die dann per os.replace() atomar an die Stelle von config.toml tritt –
+             Leser sehen nie eine halb geschriebene Datei.
+    """
+    global _cache, _cache_mtime, _clients_by_handle
+    tmp = f"{CONFIG_PATH}.{os.getpid()}.tmp"
+    try:
+        if tomli_w is not None:
+            with open(tmp, 'wb') as f:
+                tomli_w.dump(config, f)
+        else:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                toml.dump(config, f)
+        os.replace(tmp, CONFIG_PATH)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    st = os.stat(CONFIG_PATH)
+    _cache = copy.deepcopy(config)
+    _cache_mtime = (st.st_mtime_ns, st.st_size, st.st_ino)
+    _clients_by_handle = {c["handle"]: c for c in _cache.get("clients", [])}
+
 def load_full_config() -> dict:
     """
     @brief Lädt die vollständige Konfigurationsdatei.
@@ -17,28 +122,31 @@ def load_full_config() -> dict:
     @throws FileNotFoundError wenn Datei fehlt.
     """
     with _lock:
-        if not os.path.exists(CONFIG_PATH):
-            raise FileNotFoundError(f"Datei nicht gefunden: {CONFIG_PATH}")
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return toml.load(f)
+        # Kopie, damit Aufrufer das Dictionary gefahrlos verändern können
+        return copy.deepcopy(_load_locked())
 
 def save_full_config(config: dict):
     """
     @brief Schreibt die Konfiguration zurück in die Datei.
     @param config Komplette Konfiguration als Dictionary.
     """
-    with _lock:
-        with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-            toml.dump(config, f)
+    with _config_lock():
+        _save_locked(config)
 
 def is_port_available(port: int) -> bool:
     """
     @brief Prüft, ob ein TCP-Port frei ist.
+    @details Testet per bind() statt connect_ex(): erkennt auch Ports, die auf einer
+             anderen Schnittstelle gebunden sind, und spart den SYN/RST-Umlauf.
     @param port Zu prüfender Port.
     @return True wenn frei, sonst False.
     """
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('127.0.0.1', port)) != 0
+        try:
+            s.bind(('', port))
+            return True
+        except OSError:
+            return False
 
 def find_free_port(config: dict) -> int:
     """
@@ -47,7 +155,7 @@ def find_free_port(config: dict) -> int:
     @return Freier Port oder Fehler.
     """
     prange = config["defaults"].get("port_range", [5000, 5100])
-    used = [c["port"] for c in config.get("clients", [])]
+    used = {c["port"] for c in config.get("clients", [])}
     for p in range(prange[0], prange[1] + 1):
         if p not in used and is_port_available(p):
             return p
@@ -59,15 +167,16 @@ def get_or_create_client_config(handle: str) -> dict:
     @param handle Benutzername.
     @return Vollständige Konfiguration für den Client.
     """
-    config = load_full_config()
-    for c in config.get("clients", []):
-        if c["handle"] == handle:
-            break
-    else:
-        port = find_free_port(config)
-        c = {"handle": handle, "port": port}
-        config.setdefault("clients", []).append(c)
-        save_full_config(config)
+    # Lesen, ggf. Port vergeben und Schreiben unter einem Lock – kein zweiter Thread dazwischen
+    with _config_lock():
+        config = _load_locked()
+        c = _clients_by_handle.get(handle)
+        if c is None:
+            port = find_free_port(config)
+            c = {"handle": handle, "port": port}
+            config = copy.deepcopy(config)
+            config.setdefault("clients", []).append(c)
+            _save_locked(config)
 
     Path(config["defaults"]["imagepath"]).mkdir(parents=True, exist_ok=True)
     d = config["defaults"]
@@ -85,19 +194,19 @@ def load_config(handle: str = None) -> dict:
     @param handle Optionaler Benutzername.
     @return Dictionary mit Config-Daten.
     """
-    config = load_full_config()
+    with _lock:
+        config = _load_locked()
+        c = _clients_by_handle.get(handle) if handle else None
     d = config.get("defaults", {})
-    if handle:
-        for c in config.get("clients", []):
-            if c["handle"] == handle:
-                return {
-                    "handle": c["handle"],
-                    "port": c["port"],
-                    "whoisport": d["whoisport"],
-                    "autoreply": d["autoreply"],
-                    "imagepath": d["imagepath"]
-                }
-    return d
+    if c is not None:
+        return {
+            "handle": c["handle"],
+            "port": c["port"],
+            "whoisport": d["whoisport"],
+            "autoreply": d["autoreply"],
+            "imagepath": d["imagepath"]
+        }
+    return copy.deepcopy(d)
 
 def update_config_field(key: str, value):
     """
@@ -105,15 +214,20 @@ def update_config_field(key: str, value):
     @param key Schlüsselname.
     @param value Neuer Wert.
     """
-    config = load_full_config()
-    config.setdefault("defaults", {})[key] = value
-    save_full_config(config)
+    # Lesen–Ändern–Schreiben in einem kritischen Abschnitt statt zwei getrennten Lock-Runden
+    with _config_lock():
+        config = copy.deepcopy(_load_locked())
+        config.setdefault("defaults", {})[key] = value
+        _save_locked(config)
 
 def get_config_value(key: str):
     """
     @brief Holt Wert aus defaults.
+    @details Läuft bei jeder eingehenden MSG (Autoreply): liest direkt aus dem Cache,
+             ohne die ganze Konfiguration zu kopieren.
     @param key Konfig-Schlüssel.
     @return Entsprechender Wert oder None.
     """
-    return load_full_config()["defaults"].get(key)
+    with _lock:
+        return _load_locked()["defaults"].get(key)
 
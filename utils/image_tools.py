@@ -14,11 +14,29 @@ einheitlich in das BSRN-Chatprojekt eingebunden.
 """
 
 import os
-from datetime import datetime
+import time
 from pathlib import Path
 import platform
 import subprocess
 
+# Bereits angelegte Zielverzeichnisse – spart den mkdir-Syscall bei jedem weiteren Bild
+_created_dirs = set()
+
+# Flags für das direkte Schreiben (O_BINARY nur unter Windows vorhanden)
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _spawn(cmd):
+    """
+    @brief Startet den Viewer losgelöst im Hintergrund (fire-and-forget, blockiert nicht).
+    """
+    subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+# Öffner für den Standard-Viewer – Betriebssystem wird nur einmal beim Import bestimmt
+_OPENER = {
+    "Darwin": lambda p: _spawn(["open", p]),           # macOS: öffnet mit "open"
+    "Windows": lambda p: os.startfile(p),              # Windows: Standardprogramm
+}.get(platform.system(), lambda p: _spawn(["xdg-open", p]))  # Linux: xdg-open
 
 def save_image(data: bytes, target_dir: str, sender_handle: str) -> str:
     """
@@ -30,16 +48,28 @@ def save_image(data: bytes, target_dir: str, sender_handle: str) -> str:
     """
 
     # Zeitstempel für Dateinamen erzeugen
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
     filename = f"{sender_handle}_{timestamp}.jpg"
 
-    # Zielverzeichnis erstellen (rekursiv, falls nötig)
-    Path(target_dir).mkdir(parents=True, exist_ok=True)
+    # Zielverzeichnis erstellen (rekursiv, falls nötig) – nur beim ersten Bild
+    if target_dir not in _created_dirs:
+        Path(target_dir).mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(target_dir)
     full_path = os.path.join(target_dir, filename)
 
-    # Bild binär schreiben
-    with open(full_path, 'wb') as f:
-        f.write(data)
+    # Bild binär schreiben – direkt per os.write, ohne gepufferten Datei-Wrapper
+    try:
+        fd = os.open(full_path, _WRITE_FLAGS, 0o644)
+    except FileNotFoundError:
+        # Verzeichnis wurde zur Laufzeit gelöscht → neu anlegen und noch einmal versuchen
+        Path(target_dir).mkdir(parents=True, exist_ok=True)
+        fd = os.open(full_path, _WRITE_FLAGS, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
 
     # Rückgabe des vollständigen Pfads
     return full_path
@@ -53,12 +83,8 @@ def get_image_size(filepath: str) -> int:
     @raises FileNotFoundError Wenn die Datei nicht existiert
     """
 
-    # Existenz der Datei prüfen
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"Datei nicht gefunden: {filepath}")
-
-    # Größe berechnen
-    return os.path.getsize(filepath)
+    # stat() prüft die Existenz gleich mit (FileNotFoundError) – kein zweiter Syscall
+    return os.stat(filepath).st_size
 
 
 def read_image_bytes(filepath: str) -> bytes:
@@ -69,11 +95,7 @@ def read_image_bytes(filepath: str) -> bytes:
     @raises FileNotFoundError Wenn Datei nicht existiert
     """
 
-    # Existenz prüfen
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"Datei nicht gefunden: {filepath}")
-
-    # Datei als Binärdaten lesen
+    # Datei als Binärdaten lesen (open() wirft FileNotFoundError selbst)
     with open(filepath, 'rb') as f:
         return f.read()
 
@@ -93,21 +115,8 @@ def open_image(filepath: str):
         print(f"[Bildanzeige] Datei nicht gefunden: {filepath}")
         return
 
-    # Betriebssystem bestimmen
-    system = platform.system()
-
     try:
-        # macOS: öffnet mit "open"
-        if system == "Darwin":
-            subprocess.run(["open", filepath])
-
-        # Windows: öffnet mit Standardprogramm
-        elif system == "Windows":
-            os.startfile(filepath)
-
-        # Linux: nutzt xdg-open
-        else:
-            subprocess.run(["xdg-open", filepath])
+        _OPENER(filepath)
 
     except Exception as e:
         print(f"[Bildanzeige] Fehler beim Öffnen des Bildes: {e}")
@@ -0,0 +1,97 @@
+"""
+@file logger.py
+@brief Nicht-blockierendes Logging für die Hintergrundprozesse (Netzwerk, Discovery).
+
+@details
+Statt `print(...)` direkt im Empfangspfad aufzurufen (synchroner stdout-Schreibzugriff),
+legen die Threads nur einen Log-Eintrag in eine Queue. Ein QueueListener-Thread
+formatiert und schreibt ihn im Hintergrund.
+
+Der Listener-Thread startet erst beim ersten Log-Eintrag, nicht schon beim Import:
+So bleibt z. B. der forkserver, der network/discovery vorlädt, einthreadig.
+
+Das Log-Level kommt aus der Umgebungsvariable BSRN_LOGLEVEL (Standard: INFO,
+für den Produktivbetrieb z. B. WARNING). Ausgegeben wird nur die Nachricht selbst,
+damit die Ausgabe wie bisher aussieht (z. B. „[Discovery] JOIN → aktiv“).
+"""
+
+import logging, os, queue, sys, threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("BSRN_LOGLEVEL", "INFO").upper()
+
+_listener = None
+_queue_handler = None
+_start_lock = threading.Lock()
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    @brief QueueHandler, der den Listener-Thread beim ersten Eintrag startet.
+    """
+    def enqueue(self, record):
+        if _listener is None:
+            _start_listener()
+        super().enqueue(record)
+
+def _install_handler():
+    """
+    @brief Legt Queue und QueueHandler für diesen Prozess an (noch ohne Listener-Thread).
+    """
+    global _queue_handler
+    root = logging.getLogger("bsrn")
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+    _queue_handler = _LazyQueueHandler(queue.SimpleQueue())
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+def _start_listener():
+    """
+    @brief Startet den Listener-Thread, der die Queue nach stdout schreibt.
+    """
+    global _listener
+    with _start_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _listener = QueueListener(_queue_handler.queue, handler)
+        _listener.start()
+
+def _reset_after_fork():
+    """
+    @brief Setzt das Logging im Kindprozess zurück.
+    @details Nach fork() (z. B. aus dem forkserver) existiert ein evtl. laufender Listener-Thread
+             nicht mehr. Neue Queue und neuer Lock; der Listener startet beim nächsten Eintrag.
+    """
+    global _listener, _start_lock
+    _listener = None
+    _start_lock = threading.Lock()
+    if _queue_handler is not None:
+        _install_handler()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    @brief Liefert einen Logger unterhalb von „bsrn“, der über eine Queue schreibt.
+    @details Beim ersten Aufruf im Prozess werden Queue und Handler angelegt;
+             der Listener-Thread folgt mit dem ersten Log-Eintrag.
+    @param name Name des Moduls (z. B. "discovery")
+    @return Konfigurierter Logger
+    """
+    if _queue_handler is None:
+        _install_handler()
+    return logging.getLogger(f"bsrn.{name}")
+
+def shutdown_logging():
+    """
+    @brief Schreibt alle noch wartenden Log-Einträge und stoppt den Listener.
+    @details Vor dem Prozessende aufrufen – multiprocessing-Kindprozesse führen keine atexit-Handler aus.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -6,34 +6,174 @@
 Diese Datei enthält Hilfsfunktionen zur Ermittlung von Netzwerk-Broadcast-Adressen.
 Sie werden benötigt, um WHOIS- oder IAM-Nachrichten korrekt im lokalen Netzwerk zu versenden.
 
-Zwei Varianten werden unterstützt:
-- low-level ioctl-Aufruf (funktioniert nur unter Linux)
-- netifaces-basierte Erkennung für alle Plattformen (robuster)
+Drei Varianten werden unterstützt (in dieser Reihenfolge):
+- getifaddrs(3) per ctypes: alle Schnittstellen mit einem Aufruf (Linux)
+- netifaces-basierte Erkennung für alle Plattformen
+- low-level ioctl-Aufruf pro Schnittstelle (funktioniert nur unter Linux)
+
+Zusätzlich gibt es make_batch_receiver() zum gebündelten Empfang von
+UDP-Datagrammen per recvmmsg(2) (Linux, sonst Fallback auf recvfrom) und
+send_many() für den gebündelten Versand per sendmmsg(2).
 """
 
-import socket, struct, fcntl
-import os, array
+import socket, struct
+import os
+import ctypes, ctypes.util, sys, time, errno
+
+try:
+    import fcntl
+except ImportError:      # Windows: kein ioctl
+    fcntl = None
+
+from utils.logger import get_logger
+
+log = get_logger("network_utils")
+
+# ==============================================================
+# Schnittstellen-Tabelle per getifaddrs(3)
+# ==============================================================
+
+IFACE_TTL = 5.0        # Sekunden, die die Schnittstellen-Tabelle wiederverwendet wird
+IFF_BROADCAST = 0x2    # ifa_flags: Schnittstelle hat eine Broadcast-Adresse
+IFF_LOOPBACK = 0x8     # ifa_flags: Loopback
+
+class _IfAddrs(ctypes.Structure):
+    pass
+
+_IfAddrs._fields_ = [
+    ("ifa_next", ctypes.POINTER(_IfAddrs)),
+    ("ifa_name", ctypes.c_char_p),
+    ("ifa_flags", ctypes.c_uint),
+    ("ifa_addr", ctypes.c_void_p),
+    ("ifa_netmask", ctypes.c_void_p),
+    ("ifa_broadaddr", ctypes.c_void_p),   # union mit ifa_dstaddr, gültig bei IFF_BROADCAST
+    ("ifa_data", ctypes.c_void_p),
+]
+
+def _load_getifaddrs():
+    """
+    @brief Lädt getifaddrs/freeifaddrs aus der libc.
+    @return Paar (getifaddrs, freeifaddrs) oder None, wenn nicht verfügbar (z. B. kein Linux)
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        get, free = libc.getifaddrs, libc.freeifaddrs
+    except (OSError, AttributeError):
+        return None
+    get.argtypes = [ctypes.POINTER(ctypes.POINTER(_IfAddrs))]
+    get.restype = ctypes.c_int
+    free.argtypes = [ctypes.POINTER(_IfAddrs)]
+    free.restype = None
+    return get, free
+
+_getifaddrs_fns = _load_getifaddrs()
+_iface_cache = None
+_iface_cache_ts = 0.0
+
+_netifaces = None      # Modul nach dem ersten Import, False wenn nicht installiert
+
+def _load_netifaces():
+    """
+    @brief Importiert netifaces beim ersten Bedarf und merkt sich das Ergebnis.
+    @details Ein fehlgeschlagener Import wird nicht bei jedem Aufruf wiederholt
+             (das würde jedes Mal sys.path erneut durchsuchen).
+    @return Das Modul netifaces oder None, wenn es nicht installiert ist
+    """
+    global _netifaces
+    if _netifaces is None:
+        try:
+            import netifaces
+            _netifaces = netifaces
+        except ImportError:
+            _netifaces = False
+    return _netifaces or None
+
+def _ipv4_of(ptr) -> str:
+    """
+    @brief Liest die IPv4-Adresse aus einem struct sockaddr_in (oder None bei anderer Familie).
+    """
+    if not ptr:
+        return None
+    raw = ctypes.string_at(ptr, 8)
+    if struct.unpack_from("=H", raw)[0] != socket.AF_INET:
+        return None
+    return socket.inet_ntoa(raw[4:8])
+
+def _getifaddrs():
+    """
+    @brief Liest alle IPv4-Schnittstellen mit einem einzigen getifaddrs()-Aufruf.
+    @return Dictionary Name -> {"addr", "broadcast", "loopback"} (erste IPv4-Adresse je
+            Schnittstelle, Reihenfolge wie vom Kernel geliefert) oder None, wenn nicht verfügbar
+    """
+    if _getifaddrs_fns is None:
+        return None
+    get, free = _getifaddrs_fns
+    head = ctypes.POINTER(_IfAddrs)()
+    if get(ctypes.byref(head)) != 0:
+        return None
+    table = {}
+    try:
+        node = head
+        while node:
+            ifa = node.contents
+            addr = _ipv4_of(ifa.ifa_addr)
+            if addr is not None:
+                name = ifa.ifa_name.decode("utf-8", "replace")
+                if name not in table:
+                    table[name] = {
+                        "addr": addr,
+                        "broadcast": _ipv4_of(ifa.ifa_broadaddr) if ifa.ifa_flags & IFF_BROADCAST else None,
+                        "loopback": bool(ifa.ifa_flags & IFF_LOOPBACK),
+                    }
+            node = ifa.ifa_next
+    finally:
+        free(head)
+    return table
+
+def get_ipv4_interfaces():
+    """
+    @brief Liefert die IPv4-Schnittstellen-Tabelle (zwischengespeichert für IFACE_TTL Sekunden).
+    @return Dictionary Name -> {"addr", "broadcast", "loopback"} oder None, wenn getifaddrs fehlt
+    """
+    global _iface_cache, _iface_cache_ts
+    now = time.monotonic()
+    if _iface_cache is None or now - _iface_cache_ts > IFACE_TTL:
+        table = _getifaddrs()
+        if table is None:
+            return None
+        _iface_cache, _iface_cache_ts = table, now
+    return _iface_cache
 
 def get_broadcast_for_iface(iface: str) -> str:
     """
     @brief Ermittelt die Broadcast-Adresse einer bestimmten Netzwerkschnittstelle.
 
     @details
-    Nutzt low-level `ioctl`-Aufruf auf Linux-Systemen mit dem IOCTL-Code `SIOCGIFBRDADDR` (0x8919),
-    um die Broadcast-Adresse für eine gegebene Netzwerkschnittstelle (`eth0`, `wlan0`, usw.) zu erhalten.
+    Nachgeschlagen wird zuerst in der getifaddrs-Tabelle (get_ipv4_interfaces()).
+    Nur wenn getifaddrs nicht verfügbar ist, wird die Adresse per low-level `ioctl`
+    mit dem IOCTL-Code `SIOCGIFBRDADDR` (0x8919) direkt beim Kernel abgefragt.
 
     @param iface Name der Netzwerkschnittstelle (z. B. "eth0" oder "wlan0")
     @return Broadcast-Adresse als String (z. B. "192.168.0.255"), oder `None` bei Fehler
 
     @note Funktioniert nur unter Linux. Unter Windows wird automatisch `None` zurückgegeben.
     """
+    table = get_ipv4_interfaces()
+    if table is not None:
+        entry = table.get(iface)
+        return entry["broadcast"] if entry else None
+    if fcntl is None:
+        return None
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        ifreq = fcntl.ioctl(
-            s.fileno(),
-            0x8919,  # SIOCGIFBRDADDR
-            struct.pack('256s', bytes(iface[:15], 'utf-8'))
-        )
+        # ifr_name: max. 15 Byte + Nullterminator (erst kodieren, dann kürzen)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            ifreq = fcntl.ioctl(
+                s.fileno(),
+                0x8919,  # SIOCGIFBRDADDR
+                struct.pack('256s', iface.encode('utf-8')[:15])
+            )
         return socket.inet_ntoa(ifreq[20:24])
     except Exception:
         return None
@@ -43,19 +183,30 @@ def detect_broadcast_address():
     @brief Sucht nach verfügbaren Broadcast-Adressen im lokalen System.
 
     @details
-    Nutzt das Modul `netifaces`, um alle verfügbaren Netzwerkinterfaces zu durchlaufen.
-    Für jede Schnittstelle wird geprüft, ob eine IPv4-Adresse mit zugehöriger Broadcast-Adresse existiert.
-    Die erste gefundene Adresse wird zurückgegeben. Falls keine gefunden wird,
-    wird "255.255.255.255" als Fallback verwendet.
+    Die Schnittstellen werden in dieser Reihenfolge durchsucht:
+    1. getifaddrs-Tabelle (Linux, ein Aufruf für alle Schnittstellen); netifaces wird
+       dann gar nicht erst importiert. Loopback-Schnittstellen werden übersprungen.
+    2. Modul `netifaces`: erste IPv4-Adresse mit zugehöriger Broadcast-Adresse.
+    3. Ohne netifaces: Schnittstellen per `socket.if_nameindex()` aufzählen und
+       einzeln über `get_broadcast_for_iface` (ioctl) abfragen.
+    Keine Variante stellt eine DNS-Anfrage oder baut eine ausgehende Verbindung auf.
+    Wird nichts gefunden, ist "255.255.255.255" der Fallback.
 
     @return Eine gültige Broadcast-Adresse (z. B. "192.168.0.255") oder der Default "255.255.255.255"
 
     @note Diese Funktion ist plattformunabhängig und robuster als `get_broadcast_for_iface`.
     """
-    import netifaces
-    candidates = []
+    table = get_ipv4_interfaces()
+    if table is not None:
+        for entry in table.values():
+            if entry["broadcast"] and not entry["loopback"]:
+                return entry["broadcast"]
+        return "255.255.255.255"
 
-    # Alle Interfaces durchgehen
+    netifaces = _load_netifaces()
+    if netifaces is None:
+        return _detect_broadcast_ioctl()
+    # Interfaces durchgehen, bis die erste Broadcast-Adresse gefunden ist
     for iface in netifaces.interfaces():
         addrs = netifaces.ifaddresses(iface)
         if netifaces.AF_INET in addrs:
@@ -63,12 +214,209 @@ def detect_broadcast_address():
                 if 'broadcast' in entry:
                     broadcast = entry['broadcast']
                     ip = entry.get('addr', '?')
-                    print(f"[INTERFACE] {iface}: IP={ip}, Broadcast={broadcast}")
-                    candidates.append(broadcast)
-
-    # Ersten gültigen Kandidaten zurückgeben
-    if candidates:
-        return candidates[0]
+                    log.debug("[INTERFACE] %s: IP=%s, Broadcast=%s", iface, ip, broadcast)
+                    return broadcast
 
     # Fallback
     return "255.255.255.255"
+
+def _detect_broadcast_ioctl():
+    """
+    @brief Broadcast-Erkennung ohne netifaces (Linux, per SIOCGIFBRDADDR).
+    @return Erste Broadcast-Adresse einer Nicht-Loopback-Schnittstelle oder "255.255.255.255"
+    """
+    try:
+        ifaces = socket.if_nameindex()
+    except (AttributeError, OSError):
+        return "255.255.255.255"
+    for _, iface in ifaces:
+        if iface == "lo":
+            continue
+        broadcast = get_broadcast_for_iface(iface)
+        if broadcast and broadcast != "0.0.0.0":
+            return broadcast
+    return "255.255.255.255"
+
+
+# ==============================================================
+# Gebündelter UDP-Empfang (recvmmsg)
+# ==============================================================
+
+MSG_WAITFORONE = 0x10000  # recvmmsg: blockieren nur bis zum ersten Datagramm
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)  # nicht blockieren (fehlt unter Windows)
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+def _load_recvmmsg():
+    """
+    @brief Lädt recvmmsg aus der libc.
+    @return ctypes-Funktion oder None, wenn nicht verfügbar (z. B. kein Linux)
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fn = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    fn.restype = ctypes.c_int
+    return fn
+
+_recvmmsg = _load_recvmmsg()
+
+def make_batch_receiver(sock: socket.socket, batch: int = 16, bufsize: int = 1024, dontwait: bool = False):
+    """
+    @brief Erzeugt eine Empfangsfunktion, die mehrere UDP-Datagramme pro Syscall liest.
+
+    @details
+    Unter Linux wird recvmmsg(2) mit MSG_WAITFORONE genutzt: Der Aufruf blockiert,
+    bis mindestens ein Datagramm da ist, und liefert dann alle bereits wartenden
+    (bis zu `batch`) in einem Rutsch. Puffer werden einmalig vorab angelegt.
+    Auf anderen Plattformen wird auf ein einzelnes recvfrom() zurückgefallen.
+
+    Mit `dontwait` (für Aufrufer, die über selectors geweckt werden) blockiert der
+    Empfang nie: Ist inzwischen doch nichts mehr da, wird eine leere Liste geliefert.
+
+    @param sock Blockierender IPv4-UDP-Socket (ohne settimeout)
+    @param batch Maximale Anzahl Datagramme pro Aufruf
+    @param bufsize Puffergröße pro Datagramm in Bytes
+    @param dontwait Mit MSG_DONTWAIT empfangen statt zu blockieren
+    @return Funktion ohne Parameter, die eine Liste von (data, (ip, port)) liefert
+    """
+    if _recvmmsg is None:
+        if not dontwait:
+            return lambda: [sock.recvfrom(bufsize)]
+
+        def recv_one():
+            try:
+                return [sock.recvfrom(bufsize, MSG_DONTWAIT)]
+            except BlockingIOError:
+                return []
+        return recv_one
+
+    flags = MSG_WAITFORONE | (MSG_DONTWAIT if dontwait else 0)
+
+    bufs = [ctypes.create_string_buffer(bufsize) for _ in range(batch)]
+    addrs = [ctypes.create_string_buffer(16) for _ in range(batch)]  # sockaddr_in
+    iovs = (_IOVec * batch)()
+    msgs = (_MMsgHdr * batch)()
+    for i in range(batch):
+        iovs[i].iov_base = ctypes.cast(bufs[i], ctypes.c_void_p)
+        iovs[i].iov_len = bufsize
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.cast(addrs[i], ctypes.c_void_p)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+    fd = sock.fileno()
+
+    def recv_batch():
+        # Adresslängen zurücksetzen, der Kernel überschreibt sie
+        for i in range(batch):
+            msgs[i].msg_hdr.msg_namelen = 16
+        n = _recvmmsg(fd, msgs, batch, flags, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(err, os.strerror(err))
+        result = []
+        for i in range(n):
+            raw = addrs[i].raw
+            port = struct.unpack_from("!H", raw, 2)[0]
+            ip = socket.inet_ntoa(raw[4:8])
+            result.append((ctypes.string_at(bufs[i], msgs[i].msg_len), (ip, port)))
+        return result
+
+    return recv_batch
+
+
+# ==============================================================
+# Gebündelter UDP-Versand (sendmmsg)
+# ==============================================================
+
+def _load_sendmmsg():
+    """
+    @brief Lädt sendmmsg aus der libc.
+    @return ctypes-Funktion oder None, wenn nicht verfügbar (z. B. kein Linux)
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fn = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+_sendmmsg = _load_sendmmsg()
+
+def send_many(sock: socket.socket, packets: list, addr: tuple):
+    """
+    @brief Sendet mehrere UDP-Datagramme an dasselbe Ziel mit möglichst wenigen Syscalls.
+
+    @details
+    Unter Linux werden alle Pakete mit einem sendmmsg(2)-Aufruf übergeben (bei
+    Teilversand wird der Rest nachgeschoben). Bei nur einem Paket, auf anderen
+    Plattformen oder wenn das Ziel keine IPv4-Adresse ist, wird wie bisher pro
+    Paket sendto() aufgerufen.
+
+    @param sock Blockierender IPv4-UDP-Socket
+    @param packets Liste kodierter Nachrichten (bytes)
+    @param addr Ziel als (ip, port)
+    @raises OSError Wenn der Versand fehlschlägt
+    """
+    n = len(packets)
+    if _sendmmsg is None or n < 2:
+        for p in packets:
+            sock.sendto(p, addr)
+        return
+    try:
+        # struct sockaddr_in: Familie (Host-Byte-Order), Port, Adresse, 8 Byte Füllung
+        name = struct.pack("=H", socket.AF_INET) + struct.pack("!H", addr[1]) + socket.inet_aton(addr[0]) + bytes(8)
+    except OSError:
+        for p in packets:
+            sock.sendto(p, addr)
+        return
+
+    name_buf = ctypes.create_string_buffer(name, len(name))
+    bufs = [ctypes.create_string_buffer(p, len(p)) for p in packets]
+    iovs = (_IOVec * n)()
+    msgs = (_MMsgHdr * n)()
+    for i in range(n):
+        iovs[i].iov_base = ctypes.cast(bufs[i], ctypes.c_void_p)
+        iovs[i].iov_len = len(packets[i])
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.cast(name_buf, ctypes.c_void_p)
+        hdr.msg_namelen = len(name)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+
+    fd = sock.fileno()
+    base = ctypes.addressof(msgs)
+    done = 0
+    while done < n:
+        r = _sendmmsg(fd, base + done * ctypes.sizeof(_MMsgHdr), n - done, 0)
+        if r < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            raise OSError(err, os.strerror(err))
+        done += r
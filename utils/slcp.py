@@ -3,9 +3,14 @@
 @brief Generierung und Parsing von SLCP-Protokollnachrichten (JOIN, LEAVE, MSG, IMG, WHOIS, IAM)
 
 @details
-Dieses Modul stellt zwei zentrale Funktionen bereit:
-- build_message(): erstellt eine gültige SLCP-Nachricht aus Befehl + Parametern
-- parse_message(): analysiert eine eingehende SLCP-Zeile und extrahiert Befehl + Parameter
+Dieses Modul stellt folgende Funktionen bereit:
+- build_message(): erstellt eine gültige SLCP-Nachricht aus Befehl + Parametern (als str)
+- build_message_bytes(): wie build_message(), liefert die Nachricht aber direkt als UTF-8-Bytes
+  für sendto()/sendall()
+- parse_message(): analysiert eine eingehende SLCP-Zeile (str oder direkt die empfangenen bytes)
+  und extrahiert Befehl + Parameter
+- escape_param(): setzt einen einzelnen Parameter bei Bedarf in Anführungszeichen und escapt ihn
+  (z. B. für vorab kodierte Header-Präfixe)
 
 Die Nachrichten sind UTF-8 codiert, mit Zeilenumbruch, optionalen Escape-Sequenzen
 und dürfen 512 Byte nicht überschreiten (siehe SLCP-Protokolldefinition).
@@ -15,7 +20,72 @@ import re
 
 MAX_MESSAGE_LENGTH = 512     # Maximale Länge laut SLCP-Spezifikation (in Bytes, UTF-8)
 LINE_ENDING = "\n"           # Nachrichten enden immer mit Zeilenumbruch
-VALID_COMMANDS = {"JOIN", "LEAVE", "MSG", "IMG", "WHOIS", "IAM"}  # erlaubte SLCP-Kommandos
+VALID_COMMANDS = frozenset({"JOIN", "LEAVE", "MSG", "IMG", "WHOIS", "IAM"})  # erlaubte SLCP-Kommandos (unveränderlich)
+_WORD = re.compile(r'\S+')  # normales Wort: wie str.split() endet es an jedem Whitespace
+
+def _unescape(s: str) -> str:
+    """
+    @brief Löst Backslash-Escapes in einem quoted string auf (\\x → x).
+    @details escape_param() erzeugt nur \\\\ und \\". Statt des unicode_escape-Codecs
+             (Umweg über bytes, liest Nicht-ASCII als Latin-1 und zerstört so Umlaute)
+             wird nur das Zeichen nach einem Backslash übernommen.
+    """
+    if '\\' not in s:
+        return s
+    out = []
+    i = 0
+    while True:
+        j = s.find('\\', i)
+        if j == -1 or j + 1 >= len(s):
+            out.append(s[i:])
+            return ''.join(out)
+        out.append(s[i:j])
+        out.append(s[j + 1])
+        i = j + 2
+
+
+def _tokenize(s: str) -> list:
+    """
+    @brief Zerlegt eine SLCP-Zeile in einem Durchlauf in ihre Token.
+    @details Entweder ein quoted string ("mit leerzeichen", escape innerhalb erlaubt) oder
+             ein normales Wort bis zum nächsten Whitespace (Leerzeichen, Tab, ...) – also
+             dieselbe Trennregel wie str.split() im schnellen Pfad von parse_message().
+             Statt einer Regex mit Alternation und Wiederholung springt der Scanner mit
+             str.find() von Anführungszeichen zu Anführungszeichen. Ein Anführungszeichen
+             ohne Gegenstück wird wie ein normales Wort behandelt.
+    @param s Bereinigte SLCP-Zeile (ohne Zeilenumbruch)
+    @return Liste der Token (quoted strings bereits ohne Anführungszeichen und decoded)
+    """
+    parts = []
+    n = len(s)
+    i = 0
+    while i < n:
+        if s[i].isspace():
+            i += 1
+            continue
+
+        if s[i] == '"':
+            # schließendes Anführungszeichen suchen, das nicht per Backslash escaped ist
+            j = s.find('"', i + 1)
+            while j != -1:
+                k = j
+                while s[k - 1] == '\\':
+                    k -= 1
+                if (j - k) % 2 == 0:
+                    break
+                j = s.find('"', j + 1)
+            if j != -1:
+                # Escapes auflösen (\" → ", \\ → \)
+                parts.append(_unescape(s[i + 1:j]))
+                i = j + 1
+                continue
+
+        # normales Wort bis zum nächsten Whitespace
+        j = _WORD.match(s, i).end()
+        parts.append(s[i:j])
+        i = j
+    return parts
+
 
 def escape_param(param: str) -> str:
     """
@@ -32,59 +102,83 @@ def escape_param(param: str) -> str:
     return param  # Unverändert zurückgeben, wenn unkritisch
 
 
-def build_message(command: str, *params: str) -> str:
+def _assemble(command: str, params) -> str:
     """
-    @brief Baut eine SLCP-konforme Nachricht als String.
-    @param command SLCP-Kommando (z. B. MSG, JOIN, IMG, WHOIS ...)
-    @param params Beliebig viele Parameter als Strings
-    @return Vollständige Nachricht mit Zeilenumbruch (ready to send)
-    @raises ValueError Wenn das Kommando ungültig ist oder Nachricht zu lang
+    @brief Prüft das Kommando und setzt Kommando + escapte Parameter zu einer Zeile zusammen.
+    @raises ValueError Wenn das Kommando ungültig ist
     """
-
     if command not in VALID_COMMANDS:
         raise ValueError(f"Ungültiger SLCP-Befehl: {command}")
 
-    # Parameter einzeln escapen (z. B. "Max Mustermann" → "Max Mustermann")
+    # Parameter einzeln escapen (z. B. "Max Mustermann" → "Max Mustermann")
     escaped_params = [escape_param(str(p)) for p in params]
 
     # Zusammensetzen
-    message = f"{command} {' '.join(escaped_params)}{LINE_ENDING}"
+    return f"{command} {' '.join(escaped_params)}{LINE_ENDING}"
 
-    # Längenprüfung (UTF-8)
-    if len(message.encode("utf-8")) > MAX_MESSAGE_LENGTH:
+
+def build_message(command: str, *params: str) -> str:
+    """
+    @brief Baut eine SLCP-konforme Nachricht als String.
+    @param command SLCP-Kommando (z. B. MSG, JOIN, IMG, WHOIS ...)
+    @param params Beliebig viele Parameter als Strings
+    @return Vollständige Nachricht mit Zeilenumbruch (ready to send)
+    @raises ValueError Wenn das Kommando ungültig ist oder Nachricht zu lang
+    """
+    message = _assemble(command, params)
+
+    # Längenprüfung (UTF-8): ein Zeichen sind 1–4 Byte – nur im Zwischenbereich muss
+    # wirklich kodiert werden, kurze Nachrichten sind immer gültig
+    length = len(message)
+    if length > MAX_MESSAGE_LENGTH or (
+            length > MAX_MESSAGE_LENGTH // 4 and len(message.encode("utf-8")) > MAX_MESSAGE_LENGTH):
         raise ValueError(f"Nachricht überschreitet {MAX_MESSAGE_LENGTH} Byte (UTF-8)")
 
     return message
 
 
-def parse_message(raw_data: str) -> dict:
+def build_message_bytes(command: str, *params: str) -> bytes:
+    """
+    @brief Baut eine SLCP-konforme Nachricht direkt als UTF-8-Bytes (für sendto/sendall).
+    @details Kodiert genau einmal; die Längenprüfung ist dann nur noch len() der Bytes.
+             Spart das zusätzliche .encode() beim Aufrufer.
+    @param command SLCP-Kommando (z. B. MSG, JOIN, IMG, WHOIS ...)
+    @param params Beliebig viele Parameter als Strings
+    @return Vollständige Nachricht mit Zeilenumbruch als bytes
+    @raises ValueError Wenn das Kommando ungültig ist oder Nachricht zu lang
+    """
+    data = _assemble(command, params).encode("utf-8")
+    if len(data) > MAX_MESSAGE_LENGTH:
+        raise ValueError(f"Nachricht überschreitet {MAX_MESSAGE_LENGTH} Byte (UTF-8)")
+    return data
+
+
+def parse_message(raw_data) -> dict:
     """
     @brief Parst eine eingehende SLCP-Nachricht und zerlegt sie in Kommando + Parameter.
-    @param raw_data Komplette SLCP-Zeile (z. B. MSG Max "Hallo Welt\n")
+    @param raw_data Komplette SLCP-Zeile als str oder direkt als empfangene bytes
+                    (z. B. MSG Max "Hallo Welt\n")
     @return Dictionary mit:
         - "command": SLCP-Befehl als String
         - "params": Liste aller Parameter (bereinigt, decoded)
     @raises ValueError Bei leerer Eingabe, Syntaxfehler oder unbekanntem Befehl
     """
 
+    # Rohdaten vom Socket direkt annehmen (spart decode/strip beim Aufrufer)
+    if isinstance(raw_data, (bytes, bytearray)):
+        raw_data = raw_data.decode("utf-8")
+
     # Zeilenumbruch entfernen + leere Nachricht verhindern
     raw_data = raw_data.strip()
     if not raw_data:
         raise ValueError("Leere Nachricht")
 
-    # Regex: entweder ein quoted string ("mit leerzeichen") oder ein normales Wort
-    pattern = r'"((?:[^"\\]|\\.)*)"|(\S+)'  # erlaubt escape innerhalb von Anführungszeichen
-
-    # Alle passenden Token finden
-    matches = re.findall(pattern, raw_data)
-
-    parts = []
-    for quoted, plain in matches:
-        if quoted:
-            # decode unicode escapes (z. B. \" → ")
-            parts.append(bytes(quoted, "utf-8").decode("unicode_escape"))
-        else:
-            parts.append(plain)
+    # Ohne Anführungszeichen (JOIN, LEAVE, WHOIS, IAM, einfache MSG) reicht str.split(),
+    # sonst alle Token in einem Durchlauf mit dem Scanner finden
+    if '"' not in raw_data:
+        parts = raw_data.split()
+    else:
+        parts = _tokenize(raw_data)
 
     if not parts:
         raise ValueError("Unlesbare Nachricht")